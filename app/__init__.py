@@ -5,19 +5,20 @@ from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 
 # local imports
-from config import app_config
+from config import app_config, engine_options
+from .routing import RoutingSQLAlchemy
 import os
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 
 def create_app(config_name):
     
     if os.getenv('FLASK_CONFIG') == "production":
         app = Flask(__name__)
+        app.config.from_object(app_config['production'])
         app.config.update(
             SECRET_KEY=os.getenv('SECRET_KEY'),
             SQLALCHEMY_DATABASE_URI=os.getenv('SQLALCHEMY_DATABASE_URI')
@@ -25,7 +26,14 @@ def create_app(config_name):
     else:
         app = Flask(__name__, instance_relative_config=True)
         app.config.from_object(app_config[config_name])
-        app.config.from_pyfile('config.py')
+        app.config.from_pyfile('config.py', silent=True)
+
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          engine_options(app.config.get('SQLALCHEMY_DATABASE_URI')))
+    # read-only views go to this database when set
+    replica_uri = app.config.get('SQLALCHEMY_REPLICA_URI') or os.getenv('SQLALCHEMY_REPLICA_URI')
+    if replica_uri:
+        app.config.setdefault('SQLALCHEMY_BINDS', {})['replica'] = replica_uri
 
     Bootstrap(app)
     db.init_app(app)
@@ -35,7 +43,21 @@ def create_app(config_name):
     
     migrate = Migrate(app, db)
 
+    from app import assets, audit, fragments, metrics, money, pages
+    assets.init_app(app)
+    pages.init_app(app)
+    metrics.init_app(app)
+    fragments.init_app(app)
+    money.init_app(app)
+    audit.init_app(app)
+
     from app import models
+    models.principal_cache.configure(
+        maxsize=app.config.get('PRINCIPAL_CACHE_SIZE', 1024),
+        ttl=app.config.get('PRINCIPAL_CACHE_TTL', 10))
+
+    from app import tokens
+    tokens.init_app(app)
 
     from .admin import admin as admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
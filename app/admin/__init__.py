@@ -4,4 +4,4 @@ from flask import Blueprint
 
 admin = Blueprint('admin', __name__)
 
-from . import views
\ No newline at end of file
+from . import views, commands
\ No newline at end of file
@@ -0,0 +1,166 @@
+# app/admin/commands.py
+
+from datetime import datetime
+
+import click
+
+from . import admin
+from .. import barrels, bulk, exchange, ledger, rounds
+from ..balances import apply_adjustments
+
+
+@admin.cli.command('payout')
+@click.argument('csvfile', type=click.File('rb'))
+def payout(csvfile):
+    """
+    Apply balance deltas from a CSV file (id or partname, fcd, usd, sar, rub, yen)
+    """
+    report = apply_adjustments(list(bulk.read_csv(csvfile)))
+
+    for result in report['results']:
+        if result['status'] != 'ok':
+            click.echo('row {}: {} ({})'.format(
+                result['row'], result['status'], result['error']), err=True)
+
+    click.echo('Applied {} of {} rows to {} participants in {:.3f}s ({:.0f} rows/s)'.format(
+        report['applied'], len(report['results']), report['participants'],
+        report['elapsed'], report['rows_per_second'] or 0))
+
+
+@admin.cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(bulk.TABLES)))
+@click.argument('output', type=click.File('w'), default='-')
+def export_table(kind, output):
+    """
+    Write every participant or storage as CSV, to stdout by default
+    """
+    for text in bulk.export_csv(kind):
+        output.write(text)
+
+
+@admin.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(bulk.TABLES)))
+@click.argument('csvfile', type=click.File('rb'))
+@click.option('--chunk', type=int, default=bulk.DEFAULT_CHUNK, show_default=True,
+              help='Rows written and committed together.')
+def import_table(kind, csvfile, chunk):
+    """
+    Create or update participants or storages from a CSV file, matched by name
+    """
+    report = bulk.import_csv(kind, bulk.read_csv(csvfile), chunk=chunk)
+
+    for error in report['errors']:
+        click.echo('row {}: {}'.format(error['row'], error['error']), err=True)
+    click.echo('Inserted {}, updated {}, failed {} in {} chunks, {:.3f}s ({:.0f} rows/s)'.format(
+        report['inserted'], report['updated'], report['failed'], report['chunks'],
+        report['elapsed'], report['rows_per_second'] or 0))
+
+
+@admin.cli.command('move-barrels')
+@click.argument('csvfile', type=click.File('rb'))
+@click.option('--atomic', is_flag=True, help='Apply every row or none.')
+def move_barrels(csvfile, atomic):
+    """
+    Move barrels from a CSV file (id or storown, barrels)
+    """
+    report = barrels.move_many(list(bulk.read_csv(csvfile)), atomic=atomic)
+
+    for result in report['results']:
+        if result['status'] != 'ok':
+            click.echo('row {}: {} ({})'.format(
+                result['row'], result['status'], result.get('error', '')), err=True)
+    click.echo('Moved barrels for {} of {} rows'.format(
+        report['applied'], len(report['results'])))
+
+
+@admin.cli.command('set-rate')
+@click.argument('currency')
+@click.argument('rate', type=float)
+@click.option('--next', 'next_round', is_flag=True,
+              help='Apply the rate when the current round is settled.')
+def set_rate(currency, rate, next_round):
+    """
+    Set the MFD value of one unit of CURRENCY (usd, sar, rub, yen)
+    """
+    try:
+        exchange.set_rate(currency.lower(), rate, scheduled=next_round)
+    except exchange.ExchangeError as e:
+        raise click.BadParameter(str(e))
+    click.echo('1 {} = {} MFD{}'.format(currency.upper(), rate,
+                                        ' from the next round' if next_round else ''))
+
+
+@admin.cli.command('start-round')
+@click.option('--seconds', type=int, help='Round length, defaults to ROUND_SECONDS.')
+def start_round(seconds):
+    """
+    Start the next round now
+    """
+    try:
+        game_round = rounds.start(seconds)
+    except rounds.RoundError as e:
+        raise click.ClickException(str(e))
+    click.echo('Round {} runs until {} UTC'.format(game_round.number, game_round.ends_at))
+
+
+@admin.cli.command('settle-round')
+def settle_round():
+    """
+    Settle the current round if it has ended
+    """
+    game_round = rounds.current()
+    report = rounds.settle(game_round.number) if game_round is not None else None
+    if report is None:
+        raise click.ClickException('no round is waiting to be settled')
+    click.echo('Round {round} settled: {rates} rates, {interest} paid interest, '
+               '{storage_costs} charged for storage'.format(**report))
+
+
+@admin.cli.command('run-rounds')
+@click.option('--rounds', 'count', type=int, help='Stop after this many rounds.')
+@click.option('--pause', type=float, default=0, help='Seconds between rounds.')
+def run_rounds(count, pause):
+    """
+    Run the round scheduler: settle every round as it ends and start the next
+    """
+    rounds.run(rounds=count, pause=pause, log=click.echo)
+
+
+@admin.cli.command('compact-ledger')
+@click.option('--interval', type=int, help='Entries past a snapshot before folding.')
+def compact_ledger(interval):
+    """
+    Fold long ledger tails into fresh balance snapshots
+    """
+    click.echo('Wrote {} snapshots'.format(ledger.compact(interval=interval)))
+
+
+@admin.cli.command('verify-ledger')
+def verify_ledger():
+    """
+    Report accounts whose balances differ from the ledger
+    """
+    drifted = 0
+    for kind, account_id, live, recorded in ledger.verify():
+        drifted += 1
+        click.echo('{} {}: live {} ledger {}'.format(kind, account_id, live, recorded))
+    click.echo('{} accounts out of step with the ledger'.format(drifted))
+
+
+@admin.cli.command('restore')
+@click.argument('kind', type=click.Choice(['participant', 'storage']))
+@click.argument('account_id', type=int)
+@click.argument('when')
+def restore(kind, account_id, when):
+    """
+    Reset a participant or storage to its balances at WHEN (UTC, YYYY-MM-DD HH:MM:SS)
+    """
+    try:
+        when = datetime.strptime(when, '%Y-%m-%d %H:%M:%S')
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    try:
+        balances = ledger.restore(when, **{kind + '_id': account_id})
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo('Restored {} {} to {}'.format(kind, account_id, balances))
@@ -1,20 +1,60 @@
 # app/admin/forms.py
 
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField, IntegerField, FloatField
+from wtforms import StringField, SubmitField, IntegerField, HiddenField
 from wtforms.validators import DataRequired, InputRequired
 
+from ..models import CURRENCY_PLACES
+from ..money import AmountError, format_money, parse_amount
+
+
+class AmountField(StringField):
+    """
+    A text field holding an exact Decimal amount, e.g. "1,250.50"
+
+    Parsed with money.parse_amount; anything else is a form error rather
+    than being evaluated. places=0 accepts whole numbers only.
+    """
+
+    def __init__(self, label=None, validators=None, places=2, **kwargs):
+        super(AmountField, self).__init__(label, validators, **kwargs)
+        self.places = places
+
+    def _value(self):
+        if self.raw_data:
+            return self.raw_data[0]
+        if self.data is None or self.data == '':
+            return u''
+        if self.places:
+            return format_money(self.data)
+        return str(self.data)
+
+    def process_formdata(self, valuelist):
+        if valuelist:
+            try:
+                self.data = parse_amount(valuelist[0], self.places)
+            except AmountError:
+                self.data = None
+                raise ValueError('Not a valid amount')
+
 
 class ParticipantForm(FlaskForm):
     """
     Form for admin to add or edit a participant
     """
     partname = StringField('Participant', validators=[DataRequired()])
-    fcd = StringField('MFD', validators=[InputRequired()])
-    usd = StringField('USD', validators=[InputRequired()])
-    sar = StringField('SAR', validators=[InputRequired()])
-    rub = StringField('RUB', validators=[InputRequired()])
-    yen = StringField('YEN', validators=[InputRequired()])
+    fcd = AmountField('MFD', validators=[InputRequired()],
+                      places=CURRENCY_PLACES['fcd'])
+    usd = AmountField('USD', validators=[InputRequired()],
+                      places=CURRENCY_PLACES['usd'])
+    sar = AmountField('SAR', validators=[InputRequired()],
+                      places=CURRENCY_PLACES['sar'])
+    rub = AmountField('RUB', validators=[InputRequired()],
+                      places=CURRENCY_PLACES['rub'])
+    yen = AmountField('YEN', validators=[InputRequired()],
+                      places=CURRENCY_PLACES['yen'])
+    # row version the form was rendered from, see edit_participant
+    version = HiddenField()
     submit = SubmitField('Submit')
 
 class StorageForm(FlaskForm):
@@ -23,5 +63,7 @@ class StorageForm(FlaskForm):
     """
     storown = StringField('Participant', validators=[DataRequired()])
     stornum = IntegerField('StorageNumber', validators=[InputRequired()])
-    current_capacity = StringField('CurrentFill', validators=[InputRequired()])
+    current_capacity = AmountField('CurrentFill', validators=[InputRequired()],
+                                   places=0)
+    version = HiddenField()
     submit = SubmitField('Submit')
\ No newline at end of file
@@ -1,12 +1,24 @@
-from flask import abort, flash, redirect, render_template, url_for
+import hmac
+from datetime import datetime
+
+from flask import (Response, abort, current_app, flash, jsonify, redirect,
+                   render_template, request, stream_with_context, url_for)
 from flask_login import current_user, login_required
+from sqlalchemy.orm.exc import StaleDataError
 
 from . import admin
 from forms import ParticipantForm, StorageForm
-from .. import db
-from ..models import Participant, Storage
-
-max_capacity=800
+from .. import audit, barrels, bulk, changes, db, ledger
+from ..balances import apply_adjustments
+from ..metrics import registry
+from ..models import CURRENCIES, AuditEvent, Participant, Storage
+from ..pagination import keyset_page, prefix_pattern
+from ..routing import read_only
+
+# columns the admin tables can be sorted by
+# only columns with an index ending in id, see the models
+PARTICIPANT_SORTS = ('partname', 'fcd')
+STORAGE_SORTS = ('storown', 'current_capacity')
 
 def check_admin():
     """
@@ -15,20 +27,69 @@ def check_admin():
     if not current_user.is_admin:
         abort(403)
 
+def edit_conflict(template, row, fields, **context):
+    """
+    Re-render an edit form whose row changed since the form was loaded
+
+    The admin's input is kept, the values now stored are shown next to it,
+    and the form is re-armed with the current version, so submitting again
+    deliberately overwrites the other change. Answers 409 Conflict.
+    """
+    db.session.rollback()
+    db.session.refresh(row)
+    context['form'].version.data = row.version
+    flash('Error: someone else changed this row while you were editing it. '
+          'Check the current values below and submit again to overwrite them.')
+    current = [(field, getattr(row, field)) for field in fields]
+    return render_template(template, conflict=current, **context), 409
+
+def is_stale(form, row):
+    """
+    True when the row was written after the form was rendered
+    """
+    return form.version.data not in (None, '') and \
+        str(form.version.data) != str(row.version)
+
+def list_page(model, name_column, sorts):
+    """
+    Return (page, listing args) for a keyset paginated admin table
+
+    Reads q (name prefix), sort, dir, after and before from the query string.
+    """
+    q = request.args.get('q', '').strip()
+    sort = request.args.get('sort')
+    if sort not in sorts:
+        sort = sorts[0]
+    descending = request.args.get('dir') == 'desc'
+
+    query = model.query
+    if q:
+        # a prefix LIKE can use the unique index on the name column
+        query = query.filter(name_column.like(prefix_pattern(q), escape='\\'))
+
+    page = keyset_page(query, getattr(model, sort), model.id,
+                       descending=descending,
+                       after=request.args.get('after'),
+                       before=request.args.get('before'),
+                       per_page=current_app.config.get('ADMIN_PAGE_SIZE', 50))
+    return page, dict(q=q, sort=sort, dir='desc' if descending else 'asc')
+
 # Participant View
 
 @admin.route('/participants', methods=['GET', 'POST'])
 @login_required
+@read_only
 def list_participants():
     """
     List all participants
     """
     check_admin()
 
-    participants = Participant.query.all()
+    page, listing = list_page(Participant, Participant.partname, PARTICIPANT_SORTS)
 
     return render_template('admin/participants/participants.html',
-                           participants=participants, title="Participants")
+                           participants=page.items, page=page, listing=listing,
+                           title="Participants")
 
 @admin.route('/participants/add', methods=['GET', 'POST'])
 @login_required
@@ -43,18 +104,26 @@ def add_participant():
     form = ParticipantForm()
     if form.validate_on_submit():
         participant = Participant(partname=form.partname.data,
-                                  fcd = float(form.fcd.data),
-                                  usd = float(form.usd.data),
-                                  sar = float(form.sar.data),
-                                  rub = float(form.rub.data),
-                                  yen = float(form.yen.data))
+                                  fcd = form.fcd.data,
+                                  usd = form.usd.data,
+                                  sar = form.sar.data,
+                                  rub = form.rub.data,
+                                  yen = form.yen.data)
         try:
             # add participant to the database
             db.session.add(participant)
+            db.session.flush()
+            ledger.record_participant(participant, reason='open')
+            # read before the commit expires them
+            added = dict((c, getattr(participant, c)) for c in CURRENCIES)
+            added.update(id=participant.id, partname=participant.partname)
             db.session.commit()
+            audit.record('add', 'participant', added.pop('id'), added.pop('partname'),
+                         added)
             flash('You have successfully added a new participant.')
         except:
             # in case participant name already exists
+            db.session.rollback()
             flash('Error: participant name already exists.')
 
         # redirect to departments page
@@ -78,16 +147,32 @@ def edit_participant(id):
 
     participant = Participant.query.get_or_404(id)
     form = ParticipantForm(obj=participant)
+    context = dict(action="Edit", add_participant=add_participant, form=form,
+                   participant=participant, title="Edit Participant")
+    fields = ('partname',) + CURRENCIES
     if form.validate_on_submit():
+        if is_stale(form, participant):
+            return edit_conflict('admin/participants/participant.html',
+                                 participant, fields, **context)
+        before = dict((f, getattr(participant, f)) for f in fields)
         participant.partname = form.partname.data
-        print(eval( "".join( form.fcd.data.split(",") ) ))
-        participant.fcd = eval( "".join( form.fcd.data.split(",") ) ) 
-        participant.usd = eval( "".join( form.usd.data.split(",") ) )
-        participant.sar = eval( "".join( form.sar.data.split(",") ) )
-        participant.rub = eval( "".join( form.rub.data.split(",") ) )
-        participant.yen = eval( "".join( form.yen.data.split(",") ) )
-        print(participant.fcd)
-        db.session.commit()
+        participant.fcd = form.fcd.data
+        participant.usd = form.usd.data
+        participant.sar = form.sar.data
+        participant.rub = form.rub.data
+        participant.yen = form.yen.data
+        after = dict((f, getattr(participant, f)) for f in fields)
+        ledger.record(participant_id=participant.id, reason='admin_edit',
+                      **ledger.diff(before, dict((c, after[c]) for c in CURRENCIES)))
+        try:
+            db.session.commit()
+        except StaleDataError:
+            # written between our read and our commit
+            return edit_conflict('admin/participants/participant.html',
+                                 participant, fields, **context)
+        changes.feed.notify(participants=[participant.id])
+        audit.record('edit', 'participant', id, before['partname'],
+                     audit.changes(before, after))
         flash('You have successfully edited the participant.')
 
         # redirect to the departments page
@@ -99,9 +184,34 @@ def edit_participant(id):
     form.usd.data = participant.usd
     form.fcd.data = participant.fcd
     form.partname.data = participant.partname
-    return render_template('admin/participants/participant.html', action="Edit",
-                           add_participant=add_participant, form=form,
-                           participant=participant, title="Edit Participant")
+    form.version.data = participant.version
+    return render_template('admin/participants/participant.html', **context)
+
+
+@admin.route('/participants/adjust', methods=['POST'])
+@login_required
+def adjust_participants():
+    """
+    Apply a JSON batch of balance deltas, e.g. end-of-round payouts
+
+    Accepts either a list of rows or {"adjustments": [...]}, where each row
+    has an id or partname plus any of fcd/usd/sar/rub/yen. Only JSON bodies
+    are accepted, which keeps plain cross-site form posts out.
+    """
+    check_admin()
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('adjustments')
+    if not isinstance(payload, list):
+        abort(400)
+
+    report = apply_adjustments(payload)
+    for result in report['results']:
+        if result['status'] == 'ok':
+            audit.record('adjust', 'participant', result['id'], result['partname'],
+                         {'balances': result['balances']})
+    return jsonify(report)
 
 
 @admin.route('/participants/delete/<int:id>', methods=['GET', 'POST'])
@@ -113,8 +223,13 @@ def delete_participant(id):
     check_admin()
 
     participant = Participant.query.get_or_404(id)
+    ledger.record_participant(participant, reason='close', sign=-1)
+    deleted = dict((c, getattr(participant, c)) for c in CURRENCIES)
+    partname = participant.partname
     db.session.delete(participant)
     db.session.commit()
+    changes.feed.notify(participants=[id])
+    audit.record('delete', 'participant', id, partname, deleted)
     flash('You have successfully deleted the participant.')
 
     # redirect to the departments page
@@ -124,14 +239,16 @@ def delete_participant(id):
 
 @admin.route('/storages')
 @login_required
+@read_only
 def list_storages():
     check_admin()
     """
     List all storages
     """
-    storages = Storage.query.all()
+    page, listing = list_page(Storage, Storage.storown, STORAGE_SORTS)
     return render_template('admin/storages/storages.html',
-                           storages=storages, title='Storages')
+                           storages=page.items, page=page, listing=listing,
+                           title='Storages')
 
 @admin.route('/storages/add', methods=['GET', 'POST'])
 @login_required
@@ -145,8 +262,7 @@ def add_storage():
 
     form = StorageForm()
     if form.validate_on_submit():
-        print(int(form.current_capacity.data))
-        if(int(form.current_capacity.data)>max_capacity*form.stornum.data):
+        if(int(form.current_capacity.data)>barrels.capacity_per_storage()*form.stornum.data):
             flash('Error: input exceeded maximum capacity.')
         else:
             storage = Storage(storown=form.storown.data,
@@ -156,10 +272,17 @@ def add_storage():
             try:
                 # add storage to the database
                 db.session.add(storage)
+                db.session.flush()
+                ledger.record_storage(storage, reason='open')
+                storage_id = storage.id
                 db.session.commit()
+                audit.record('add', 'storage', storage_id, form.storown.data,
+                             {'stornum': form.stornum.data,
+                              'current_capacity': int(form.current_capacity.data)})
                 flash('You have successfully added a new storage.')
             except:
                 # in case storage name already exists
+                db.session.rollback()
                 flash('Error: storage already exists.')
 
         # redirect to the storages page
@@ -182,15 +305,32 @@ def edit_storage(id):
 
     storage = Storage.query.get_or_404(id)
     form = StorageForm(obj=storage)
+    context = dict(add_storage=add_storage, form=form, title="Edit Storage")
+    fields = ('storown', 'stornum', 'current_capacity')
     if form.validate_on_submit():
-        if( eval(form.current_capacity.data ) > form.stornum.data * max_capacity):
+        if is_stale(form, storage):
+            return edit_conflict('admin/storages/storage.html', storage, fields,
+                                 **context)
+        if(int(form.current_capacity.data) > form.stornum.data * barrels.capacity_per_storage()):
             flash('Error: input exceeded maximum capacity.')
         else:
+            before = dict((f, getattr(storage, f)) for f in fields)
             storage.storown = form.storown.data
             storage.stornum = form.stornum.data
-            storage.current_capacity = eval( "".join( form.current_capacity.data.split(",") ) )
+            storage.current_capacity = int(form.current_capacity.data)
+            after = dict((f, getattr(storage, f)) for f in fields)
+            ledger.record(storage_id=storage.id, reason='admin_edit',
+                          **ledger.diff({ledger.BARRELS: before['current_capacity']},
+                                        {ledger.BARRELS: after['current_capacity']}))
             db.session.add(storage)
-            db.session.commit()
+            try:
+                db.session.commit()
+            except StaleDataError:
+                return edit_conflict('admin/storages/storage.html', storage,
+                                     fields, **context)
+            changes.feed.notify(storages=[storage.id])
+            audit.record('edit', 'storage', id, before['storown'],
+                         audit.changes(before, after))
             flash('You have successfully edited the storage.')
 
         # redirect to the storages page
@@ -199,8 +339,62 @@ def edit_storage(id):
     form.current_capacity.data = storage.current_capacity
     form.stornum.data = storage.stornum
     form.storown.data = storage.storown
-    return render_template('admin/storages/storage.html', add_storage=add_storage,
-                           form=form, title="Edit Storage")
+    form.version.data = storage.version
+    return render_template('admin/storages/storage.html', **context)
+
+
+@admin.route('/storages/move/<int:id>', methods=['POST'])
+@login_required
+def move_barrels(id):
+    """
+    Deposit or withdraw barrels for one storage, JSON body {"barrels": n}
+    """
+    check_admin()
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        abort(400)
+    try:
+        fill = barrels.move(id, payload.get('barrels'))
+    except barrels.CapacityExceeded as e:
+        return jsonify(error=str(e)), 409
+    except barrels.StorageNotFound as e:
+        return jsonify(error=str(e)), 404
+    except barrels.StorageError as e:
+        return jsonify(error=str(e)), 400
+    except (TypeError, ValueError):
+        abort(400)
+    storown = db.session.query(Storage.storown).filter(Storage.id == id).scalar()
+    audit.record('move', 'storage', id, storown,
+                 {'barrels': payload.get('barrels'), 'current_capacity': fill})
+    return jsonify(id=id, current_capacity=fill)
+
+
+@admin.route('/storages/move', methods=['POST'])
+@login_required
+def move_barrels_batch():
+    """
+    Move barrels for many storages at once
+
+    Accepts a list of {id or storown, barrels} rows, or
+    {"moves": [...], "atomic": true} to apply all rows or none.
+    """
+    check_admin()
+
+    payload = request.get_json(silent=True)
+    atomic = False
+    if isinstance(payload, dict):
+        atomic = bool(payload.get('atomic'))
+        payload = payload.get('moves')
+    if not isinstance(payload, list):
+        abort(400)
+
+    report = barrels.move_many(payload, atomic=atomic)
+    for entry, result in zip(payload, report['results']):
+        if result['status'] == 'ok':
+            audit.record('move', 'storage', result['id'], result['storown'],
+                         {'barrels': entry.get('barrels')})
+    return jsonify(report)
 
 
 @admin.route('/storages/delete/<int:id>', methods=['GET', 'POST'])
@@ -212,11 +406,114 @@ def delete_storage(id):
     check_admin()
 
     storage = Storage.query.get_or_404(id)
+    ledger.record_storage(storage, reason='close', sign=-1)
+    deleted = dict(stornum=storage.stornum, current_capacity=storage.current_capacity)
+    storown = storage.storown
     db.session.delete(storage)
     db.session.commit()
+    changes.feed.notify(storages=[id])
+    audit.record('delete', 'storage', id, storown, deleted)
     flash('You have successfully deleted the storage.')
 
     # redirect to the storages page
     return redirect(url_for('admin.list_storages'))
 
-    return render_template(title="Delete Storage")
\ No newline at end of file
+    return render_template(title="Delete Storage")
+
+
+@admin.route('/<any(participants, storages):kind>/export')
+@login_required
+@read_only
+def export_table(kind):
+    """
+    Download every participant or storage as CSV, streamed as it is read
+    """
+    check_admin()
+
+    return Response(stream_with_context(bulk.export_csv(kind)), mimetype='text/csv',
+                    headers={'Content-Disposition':
+                             'attachment; filename={}.csv'.format(kind)})
+
+
+@admin.route('/<any(participants, storages):kind>/import', methods=['POST'])
+@login_required
+def import_table(kind):
+    """
+    Create or update participants or storages from a CSV request body
+
+    The body is read as it arrives and written chunk by chunk, see
+    bulk.import_csv. Only "Content-Type: text/csv" is accepted, which plain
+    cross-site form posts cannot send.
+    """
+    check_admin()
+
+    if request.mimetype != 'text/csv':
+        abort(415)
+    chunk = request.args.get('chunk', bulk.DEFAULT_CHUNK, type=int)
+    report = bulk.import_csv(kind, bulk.read_csv(request.stream), chunk=max(1, chunk))
+    audit.record('import', kind[:-1], details=dict(
+        (k, report[k]) for k in ('inserted', 'updated', 'failed')))
+    return jsonify(report)
+
+
+def parse_time(value):
+    """
+    Read a datetime-local input ("2020-02-20T10:00") or "2020-02-20 10:00:00"
+    """
+    for format in ('%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S',
+                   '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    return None
+
+
+@admin.route('/audit')
+@login_required
+@read_only
+def audit_log():
+    """
+    Who changed what, newest first, by participant and time range (UTC)
+    """
+    check_admin()
+
+    listing = dict((k, request.args.get(k, '').strip())
+                   for k in ('participant', 'since', 'until'))
+    times = {}
+    for key in ('since', 'until'):
+        if listing[key]:
+            times[key] = parse_time(listing[key])
+            if times[key] is None:
+                flash('Error: cannot read {} time {!r}.'.format(key, listing[key]))
+    query = audit.search(listing['participant'], times.get('since'), times.get('until'))
+    # ids grow with time, so the id alone is the page key
+    page = keyset_page(query, AuditEvent.id, AuditEvent.id, descending=True,
+                       after=request.args.get('after'),
+                       before=request.args.get('before'),
+                       per_page=current_app.config.get('ADMIN_PAGE_SIZE', 50))
+    return render_template('admin/audit.html', events=page.items, page=page,
+                           listing=listing, title="Audit log")
+
+
+@admin.route('/metrics')
+def metrics():
+    """
+    Request, SQL, render and hashing time per endpoint
+
+    Served as Prometheus text with ?format=prometheus, or to a scraper that
+    sends "Authorization: Bearer <METRICS_TOKEN>" instead of logging in.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    scraper = bool(token) and hmac.compare_digest(
+        str(request.headers.get('Authorization', '')), str('Bearer ' + token))
+    if not scraper:
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        check_admin()
+
+    if scraper or request.args.get('format') == 'prometheus':
+        return Response(registry.prometheus(),
+                        mimetype='text/plain; version=0.0.4')
+    return render_template('admin/metrics.html', endpoints=registry.endpoints(),
+                           n_plus_one=registry.n_plus_one(), title="Metrics")
@@ -0,0 +1,289 @@
+# app/assets.py
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import posixpath
+import re
+import threading
+
+import click
+from flask import current_app, request, safe_join, send_from_directory, url_for
+from flask.cli import AppGroup
+
+try:
+    from PIL import Image
+except ImportError:  # images are copied but not resized
+    Image = None
+
+MANIFEST = 'manifest.json'
+# files that get a gzipped copy next to them, when it is smaller
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+RESIZABLE = ('.jpg', '.jpeg', '.png')
+DEFAULT_WIDTHS = (160, 320, 640)
+# hashed files never change, so browsers may keep them for a year
+MAX_AGE = 365 * 24 * 3600
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+logger = logging.getLogger(__name__)
+
+
+def output_folder(app):
+    return app.config.get('ASSETS_FOLDER') or os.path.join(app.static_folder, 'dist')
+
+
+def _hashed(path, data, suffix=''):
+    root, ext = posixpath.splitext(path)
+    return '{}{}.{}{}'.format(root, suffix, hashlib.md5(data).hexdigest()[:10], ext)
+
+
+def _gzipped(data):
+    buffer = io.BytesIO()
+    # a fixed mtime keeps the output identical between builds
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buffer, compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def _write(folder, name, data):
+    """
+    Write data to folder/name, plus name.gz for text worth compressing
+
+    Returns True when a gzipped copy was written.
+    """
+    target = os.path.join(folder, *name.split('/'))
+    if not os.path.isdir(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+    with open(target, 'wb') as f:
+        f.write(data)
+    if name.endswith(COMPRESSIBLE):
+        compressed = _gzipped(data)
+        if len(compressed) < len(data):
+            with open(target + '.gz', 'wb') as f:
+                f.write(compressed)
+            return True
+    return False
+
+
+def _sources(static_folder, skip):
+    """
+    Yield the path of every file under static_folder, relative and with /
+    """
+    skip = os.path.abspath(skip)
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != skip)
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(root, name), static_folder)
+            yield path.replace(os.sep, '/')
+
+
+def _rewrite_css(path, data, static_folder, files):
+    """
+    Point url(...) references of a stylesheet at the hashed files
+    """
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        quote, url = match.group(1), match.group(2)
+        if url.startswith(('/', '#')) or ':' in url:
+            return match.group(0)
+        target = os.path.normpath(os.path.join(static_folder, directory, url))
+        name = os.path.relpath(target, static_folder).replace(os.sep, '/')
+        if name not in files:
+            return match.group(0)
+        return 'url({0}{1}{0})'.format(quote, posixpath.relpath(files[name], directory or '.'))
+
+    return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def _resized(data, widths, quality):
+    """
+    Return (original width, [(width, image data)]) for widths below the original
+    """
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    width, height = image.size
+    variants = []
+    for target in sorted(widths):
+        if target >= width:
+            continue
+        size = (target, max(1, int(round(height * target / float(width)))))
+        buffer = io.BytesIO()
+        options = {'optimize': True}
+        if image.format == 'JPEG':
+            options.update(quality=quality, progressive=True)
+        image.resize(size, Image.LANCZOS).save(buffer, image.format, **options)
+        variants.append((target, buffer.getvalue()))
+    return width, variants
+
+
+def build(app=None, widths=None):
+    """
+    Write content-hashed copies of the static files and a manifest
+
+    Stylesheets are written last, with their url(...) references pointing at
+    the hashed names. Text files also get a gzipped copy, and with Pillow
+    installed, JPEG and PNG images get resized variants at ASSETS_IMAGE_WIDTHS.
+    Files of earlier builds are left in place for pages still referring to
+    them; the manifest is replaced last, in one rename. Returns a summary.
+    """
+    app = app or current_app._get_current_object()
+    folder = output_folder(app)
+    widths = widths or app.config.get('ASSETS_IMAGE_WIDTHS', DEFAULT_WIDTHS)
+    quality = app.config.get('ASSETS_JPEG_QUALITY', 85)
+    paths = list(_sources(app.static_folder, folder))
+    # stylesheets refer to the other files, so they are hashed after them
+    paths.sort(key=lambda p: p.endswith('.css'))
+    if Image is None:
+        logger.warning('Pillow is not installed, images are copied without resized variants')
+
+    manifest = {'files': {}, 'variants': {}, 'widths': {}}
+    report = {'files': 0, 'gzipped': 0, 'variants': 0, 'resized': Image is not None,
+              'gzip_in': 0, 'gzip_out': 0}
+    for path in paths:
+        with open(os.path.join(app.static_folder, *path.split('/')), 'rb') as f:
+            data = f.read()
+        if path.endswith('.css'):
+            data = _rewrite_css(path, data, app.static_folder, manifest['files'])
+        name = _hashed(path, data)
+        manifest['files'][path] = name
+        report['files'] += 1
+        if _write(folder, name, data):
+            report['gzipped'] += 1
+            report['gzip_in'] += len(data)
+            report['gzip_out'] += os.path.getsize(
+                os.path.join(folder, *name.split('/')) + '.gz')
+        if Image is not None and path.lower().endswith(RESIZABLE):
+            width, variants = _resized(data, widths, quality)
+            manifest['widths'][path] = width
+            for size, resized in variants:
+                variant = _hashed(path, resized, '-{}'.format(size))
+                manifest['variants'].setdefault(path, {})[str(size)] = variant
+                _write(folder, variant, resized)
+                report['variants'] += 1
+
+    target = os.path.join(folder, MANIFEST)
+    with open(target + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(target + '.tmp', target)
+    manifests.clear()
+    return report
+
+
+class Manifests(object):
+    """
+    The built manifest, read once and again whenever the file changes
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._mtime = None
+
+    def get(self, app):
+        path = os.path.join(output_folder(app), MANIFEST)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            with self._lock:
+                with open(path) as f:
+                    self._manifest = json.load(f)
+                self._mtime = mtime
+        return self._manifest
+
+    def clear(self):
+        with self._lock:
+            self._manifest = None
+            self._mtime = None
+
+
+manifests = Manifests()
+
+
+def _manifest():
+    app = current_app
+    if not app.config.get('ASSETS_HASHED', not app.debug):
+        return None
+    return manifests.get(app)
+
+
+def asset_url(filename, width=None, **values):
+    """
+    URL of a static file by its hashed name, e.g. {{ asset_url('css/style.css') }}
+
+    With width, the smallest resized variant at least that wide, if any.
+    Without a build (or with ASSETS_HASHED off, the default when debugging)
+    this is url_for('static', filename=filename).
+    """
+    manifest = _manifest()
+    name = manifest['files'].get(filename) if manifest is not None else None
+    if name is None:
+        return url_for('static', filename=filename, **values)
+    if width is not None:
+        variants = manifest['variants'].get(filename, {})
+        fitting = sorted(int(w) for w in variants if int(w) >= width)
+        if fitting:
+            name = variants[str(fitting[0])]
+    return url_for('assets', filename=name, **values)
+
+
+def asset_srcset(filename):
+    """
+    srcset attribute value listing the resized variants and the original
+    """
+    manifest = _manifest()
+    if manifest is None or filename not in manifest['widths']:
+        return ''
+    variants = manifest['variants'].get(filename, {})
+    candidates = ['{} {}w'.format(url_for('assets', filename=variants[w]), w)
+                  for w in sorted(variants, key=int)]
+    candidates.append('{} {}w'.format(url_for('assets', filename=manifest['files'][filename]),
+                                      manifest['widths'][filename]))
+    return ', '.join(candidates)
+
+
+def serve(filename):
+    """
+    Send a built file, gzipped when the browser accepts it, cached for good
+    """
+    folder = output_folder(current_app)
+    compressed = request.accept_encodings['gzip'] and \
+        os.path.isfile(safe_join(folder, filename + '.gz'))
+    response = send_from_directory(folder, filename + '.gz' if compressed else filename,
+                                   cache_timeout=MAX_AGE)
+    if compressed:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(MAX_AGE)
+    return response
+
+
+assets_cli = AppGroup('assets', help='Build the static files.')
+
+
+@assets_cli.command('build')
+@click.option('--width', 'widths', type=int, multiple=True,
+              help='Width of resized images, may be repeated.')
+def build_command(widths):
+    """
+    Hash, compress and resize the static files for asset_url
+    """
+    report = build(widths=widths or None)
+    click.echo('Built {} files, {} gzipped ({} to {} bytes), {} resized images'.format(
+        report['files'], report['gzipped'], report['gzip_in'], report['gzip_out'],
+        report['variants']))
+    if not report['resized']:
+        click.echo('Pillow is not installed, images were not resized', err=True)
+
+
+def init_app(app):
+    app.cli.add_command(assets_cli)
+    app.add_url_rule(app.config.get('ASSETS_URL_PATH', '/assets') + '/<path:filename>',
+                     'assets', serve)
+    app.jinja_env.globals.update(asset_url=asset_url, asset_srcset=asset_srcset)
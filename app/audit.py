@@ -0,0 +1,210 @@
+# app/audit.py
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+
+try:
+    from queue import Empty, Full, Queue
+except ImportError:  # Python 2
+    from Queue import Empty, Full, Queue
+
+from flask import current_app, has_request_context
+from flask_login import current_user
+
+from . import db
+from .models import AuditEvent
+
+DEFAULT_QUEUE = 10000
+DEFAULT_BATCH = 500
+DEFAULT_INTERVAL = 1.0
+# how long record() waits for room in a full queue before writing itself
+DEFAULT_ENQUEUE_TIMEOUT = 0.5
+WRITE_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+# queue markers for the writer thread
+_FLUSH = object()
+_STOP = object()
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def changes(before, after):
+    """
+    Return {field: [before, after]} for the fields of after that changed
+    """
+    return dict((k, [before.get(k), v]) for k, v in after.items()
+                if before.get(k) != v)
+
+
+class AuditTrail(object):
+    """
+    Audit events queued in memory and written to audit_log in batches
+
+    record() only appends to a queue, so the admin views pay no extra round
+    trip. A writer thread inserts whatever has queued up with one
+    executemany every AUDIT_FLUSH_INTERVAL seconds, or as soon as
+    AUDIT_BATCH_SIZE events are waiting. If the writer falls behind and
+    AUDIT_QUEUE_SIZE events are queued, record() waits up to
+    AUDIT_ENQUEUE_TIMEOUT seconds for room and then writes its event itself:
+    a backlog slows admins down rather than losing events. The queue is
+    flushed at interpreter exit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self.written = 0
+        self.failed = 0
+
+    def init_app(self, app):
+        if self._app is not None and self._app is not app:
+            # one writer per process, for the app it was started for
+            self.close()
+        self._app = app
+
+    def _config(self, key, default):
+        return self._app.config.get(key, default)
+
+    def _ensure(self):
+        # a thread inherited through fork is not running, start a new one
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    if self._app is None:
+                        self._app = current_app._get_current_object()
+                    self._queue = Queue(self._config('AUDIT_QUEUE_SIZE', DEFAULT_QUEUE))
+                    thread = threading.Thread(target=self._run, args=(self._queue,),
+                                              name='audit-writer')
+                    thread.daemon = True
+                    thread.start()
+                    self._thread = thread
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _write(self, events):
+        table = AuditEvent.__table__
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                with db.get_engine(self._app).begin() as connection:
+                    connection.execute(table.insert(), events)
+                self.written += len(events)
+                return
+            except Exception:
+                logger.exception('writing %d audit events failed', len(events))
+                time.sleep(0.1 * 2 ** attempt)
+        self.failed += len(events)
+
+    def _run(self, queue):
+        interval = self._config('AUDIT_FLUSH_INTERVAL', DEFAULT_INTERVAL)
+        size = self._config('AUDIT_BATCH_SIZE', DEFAULT_BATCH)
+        while True:
+            batch, markers = [], 0
+            deadline = time.time() + interval
+            stop = False
+            while len(batch) < size:
+                try:
+                    item = queue.get(timeout=max(0.0, deadline - time.time()))
+                except Empty:
+                    break
+                if item is _FLUSH or item is _STOP:
+                    markers += 1
+                    stop = item is _STOP
+                    break
+                batch.append(item)
+            if batch:
+                self._write(batch)
+            for _ in range(len(batch) + markers):
+                queue.task_done()
+            if stop:
+                return
+
+    def record(self, action, kind, target_id=None, partname=None, details=None):
+        """
+        Queue an event, e.g. record('edit', 'participant', 3, 'Team A', {'fcd': [10, 20]})
+
+        The acting user is taken from the request. Nothing is written in
+        the caller's transaction, so record after the change is committed.
+        """
+        event = dict(created_at=datetime.utcnow(), actor_id=None, actor=None,
+                     action=action, kind=kind, target_id=target_id,
+                     partname=partname,
+                     details=json.dumps(details, default=_plain, sort_keys=True)
+                     if details else None)
+        if has_request_context() and current_user.is_authenticated:
+            event.update(actor_id=current_user.id, actor=current_user.username)
+
+        if self._app is None:
+            self._app = current_app._get_current_object()
+        if not self._config('AUDIT_ASYNC', True):
+            self._write([event])
+            return
+        queue = self._ensure()
+        try:
+            queue.put(event, timeout=self._config('AUDIT_ENQUEUE_TIMEOUT',
+                                                  DEFAULT_ENQUEUE_TIMEOUT))
+        except Full:
+            self._write([event])
+
+    def flush(self):
+        """
+        Block until every event queued so far is written
+        """
+        if self._thread is not None and self._pid == os.getpid() and \
+                self._thread.is_alive():
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def close(self):
+        """
+        Write what is queued and stop the writer thread
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is not None and self._pid == os.getpid() and thread.is_alive():
+                self._queue.put(_STOP)
+                thread.join(self._config('AUDIT_CLOSE_TIMEOUT', 10))
+            self._thread = None
+            self._queue = None
+
+    def __len__(self):
+        """
+        Number of events waiting to be written
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+
+trail = AuditTrail()
+record = trail.record
+flush = trail.flush
+init_app = trail.init_app
+atexit.register(trail.close)
+
+
+def search(partname=None, since=None, until=None):
+    """
+    Return a query of audit events, optionally for one participant and
+    between two datetimes
+    """
+    query = AuditEvent.query
+    if partname:
+        query = query.filter(AuditEvent.partname == partname)
+    if since is not None:
+        query = query.filter(AuditEvent.created_at >= since)
+    if until is not None:
+        query = query.filter(AuditEvent.created_at < until)
+    return query
@@ -0,0 +1,63 @@
+# app/auth/commands.py
+
+import csv
+
+import click
+
+from . import auth
+from .. import db, tokens
+from ..models import User, invalidate_principal
+from ..teams import import_teams
+
+
+@auth.cli.command('import-teams')
+@click.argument('csvfile', type=click.File('r'))
+@click.option('--batch-size', default=500, show_default=True,
+              help='Teams written per transaction.')
+@click.option('--workers', type=int,
+              help='Password hashing processes (default: one per CPU).')
+def import_teams_command(csvfile, batch_size, workers):
+    """
+    Pre-register teams from a CSV file with username and password columns
+    """
+    rows = ((row.get('username'), row.get('password'))
+            for row in csv.DictReader(csvfile))
+    report = import_teams(rows, batch_size=batch_size, workers=workers)
+    click.echo('Created {created} teams, skipped {skipped} existing in {elapsed:.1f}s '
+               '({hash_seconds:.1f}s hashing)'.format(**report))
+
+
+def _user(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException('no user {}'.format(username))
+    return user
+
+
+@auth.cli.command('revoke')
+@click.argument('username')
+def revoke_command(username):
+    """
+    Sign a user out of every session
+    """
+    user = _user(username)
+    tokens.revoke_user(user.id)
+    db.session.commit()
+    invalidate_principal(user.id)
+    click.echo('Revoked every session of {}'.format(username))
+
+
+@auth.cli.command('ban')
+@click.argument('username')
+@click.option('--lift', is_flag=True, help='Allow the user to log in again.')
+def ban_command(username, lift):
+    """
+    Disable a user and sign it out of every session
+    """
+    user = _user(username)
+    user.disabled = not lift
+    if not lift:
+        tokens.revoke_user(user.id)
+    db.session.commit()
+    invalidate_principal(user.id)
+    click.echo('{} {}'.format(username, 'may log in again' if lift else 'is banned'))
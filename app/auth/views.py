@@ -1,12 +1,17 @@
 from flask import flash, redirect, render_template, url_for
 from flask_login import login_required, login_user, logout_user
+from sqlalchemy.exc import IntegrityError
 
 from . import auth
 from forms import LoginForm, RegistrationForm
-from .. import db
-from ..models import User, Participant, Storage
+from .. import db, tokens
+from ..models import User, invalidate_principal
+from ..pages import cached_page
+from ..passwords import HashingBusy
+from ..teams import create_team
 
 @auth.route('/register', methods=['GET', 'POST'])
+@cached_page
 def register():
     """
     Handle requests to the /register route
@@ -14,23 +19,16 @@ def register():
     """
     form = RegistrationForm()
     if form.validate_on_submit():
-        user = User( username=form.username.data,
-                     password=form.password.data)
-
-        # add user to the database
-        db.session.add(user)
-        db.session.commit()
-
-        participant = Participant(partname=form.username.data,
-                                  fcd = 100000.0, usd=0.0, sar=0.0, rub=0.0, yen=0.0)
-        db.session.add(participant)
-        db.session.commit()
-
-        storage = Storage(storown=form.username.data,
-                          stornum=1,
-                          current_capacity=0)
-        db.session.add(storage)
-        db.session.commit()
+        try:
+            # add user, participant and storage to the database together
+            create_team(form.username.data, form.password.data)
+        except IntegrityError:
+            flash('Error: team name already exists.')
+            return render_template('auth/register.html', form=form, title='Register')
+        except HashingBusy:
+            flash('Too many teams are registering right now, please try again.')
+            return render_template('auth/register.html', form=form,
+                                   title='Register'), 503
 
         flash('You have successfully registered! You may now login.')
 
@@ -43,6 +41,7 @@ def register():
 # Edit the login view to redirect to the admin dashboard if user is an admin
 
 @auth.route('/login', methods=['GET', 'POST'])
+@cached_page
 def login():
     """
     Handle requests to the /login route
@@ -53,10 +52,23 @@ def login():
         # check whether employee exists in the database and whether
         # the password entered matches the password in the database
         user = User.query.filter_by(username=form.username.data).first()
-        if user is not None and user.verify_password(
-                form.password.data):
+        try:
+            verified = user is not None and user.verify_password(
+                form.password.data)
+            # upgrade hashes made with an older method or cost
+            if verified and user.rehash_password(form.password.data):
+                db.session.commit()
+                invalidate_principal(user.id)
+        except HashingBusy:
+            flash('Too many teams are logging in right now, please try again.')
+            return render_template('auth/login.html', form=form,
+                                   title='Login'), 503
+        if verified and not user.is_active:
+            flash('This team has been disabled.')
+        elif verified:
             # log employee in
             login_user(user)
+            tokens.issue(user)
             # redirect to the appropriate dashboard page
             if user.is_admin:
                 users = User.query.all()
@@ -80,6 +92,7 @@ def logout():
     Handle requests to the /logout route
     Log an employee out through the logout link
     """
+    tokens.revoke_session()
     logout_user()
     flash('You have successfully been logged out.')
 
@@ -0,0 +1,155 @@
+# app/balances.py
+
+import time
+from decimal import Decimal
+
+from sqlalchemy import bindparam, or_
+
+from . import changes, db, ledger
+from .models import CURRENCIES, CURRENCY_PLACES, Participant
+from .money import PLACES, to_decimal
+
+
+def to_number(value, places=PLACES):
+    """
+    Convert a submitted amount ("1,250.5", 3, u"-20") to an exact Decimal
+    """
+    if value is None or not str(value).strip():
+        return Decimal(0)
+    return to_decimal(value, places)
+
+
+def _normalize(index, row):
+    """
+    Validate one adjustment row and return (key, deltas) or raise ValueError
+    """
+    if not isinstance(row, dict):
+        raise ValueError('row {} is not an object'.format(index))
+    if row.get('id') not in (None, ''):
+        try:
+            key = ('id', int(row['id']))
+        except (TypeError, ValueError):
+            raise ValueError('row {}: invalid id {!r}'.format(index, row['id']))
+    elif row.get('partname'):
+        if not isinstance(row['partname'], (type(''), type(u''))):
+            raise ValueError('row {}: invalid partname {!r}'.format(index, row['partname']))
+        key = ('partname', row['partname'].strip())
+    else:
+        raise ValueError('row {} has neither id nor partname'.format(index))
+
+    deltas = {}
+    for currency in CURRENCIES:
+        try:
+            deltas[currency] = to_number(row.get(currency), CURRENCY_PLACES[currency])
+        except (TypeError, ValueError):
+            raise ValueError('row {}: invalid {} amount {!r}'.format(
+                index, currency, row.get(currency)))
+    return key, deltas
+
+
+def apply_totals(totals, reason):
+    """
+    Add {participant id: {currency: delta}} to the balances, without committing
+
+    One executemany UPDATE (``fcd = fcd + :d_fcd``) plus the matching ledger
+    entries; the caller owns the transaction and the change notification.
+    """
+    table = Participant.__table__
+    values = dict((c, table.c[c] + bindparam('d_' + c)) for c in CURRENCIES)
+    values['version'] = table.c.version + 1
+    stmt = table.update().where(table.c.id == bindparam('pid')).values(values)
+    params = []
+    for pid, total in totals.items():
+        param = dict(('d_' + c, total.get(c, 0.0)) for c in CURRENCIES)
+        param['pid'] = pid
+        params.append(param)
+    db.session.execute(stmt, params)
+    ledger.record_many(
+        (dict(participant_id=pid, asset=c, delta=v)
+         for pid, total in totals.items() for c, v in total.items()),
+        reason=reason)
+
+
+def apply_adjustments(rows):
+    """
+    Apply a batch of per-participant balance deltas in one transaction
+
+    Each row is a mapping with an ``id`` or ``partname`` and any of the
+    currency columns. Participants are resolved with a single query, all
+    deltas go out as one executemany UPDATE (``fcd = fcd + :delta``) and the
+    new balances are read back with one more query, so the cost no longer
+    grows with a round trip and a commit per participant.
+    """
+    started = time.time()
+    results = []
+    pending = []
+
+    for index, row in enumerate(rows):
+        result = {'row': index, 'status': 'ok'}
+        try:
+            key, deltas = _normalize(index, row)
+        except (TypeError, ValueError) as e:
+            result.update(status='invalid', error=str(e))
+        else:
+            result[key[0]] = key[1]
+            pending.append((result, key, deltas))
+        results.append(result)
+
+    ids = set(key[1] for _, key, _ in pending if key[0] == 'id')
+    names = set(key[1] for _, key, _ in pending if key[0] == 'partname')
+    by_id, by_name = {}, {}
+    if ids or names:
+        criteria = []
+        if ids:
+            criteria.append(Participant.id.in_(list(ids)))
+        if names:
+            criteria.append(Participant.partname.in_(list(names)))
+        found = db.session.query(Participant.id, Participant.partname).filter(
+            or_(*criteria))
+        for pid, partname in found:
+            by_id[pid] = partname
+            by_name[partname] = pid
+
+    # several rows may target the same participant; sum them up first
+    totals = {}
+    for result, key, deltas in pending:
+        pid = key[1] if key[0] == 'id' else by_name.get(key[1])
+        if pid not in by_id:
+            result.update(status='not_found',
+                          error='no participant {}'.format(key[1]))
+            continue
+        result.update(id=pid, partname=by_id[pid])
+        total = totals.setdefault(pid, dict.fromkeys(CURRENCIES, Decimal(0)))
+        for currency in CURRENCIES:
+            total[currency] += deltas[currency]
+
+    balances = {}
+    if totals:
+        try:
+            apply_totals(totals, reason='adjustment')
+            columns = [getattr(Participant, c) for c in CURRENCIES]
+            updated = db.session.query(Participant.id, *columns).filter(
+                Participant.id.in_(list(totals)))
+            for row in updated:
+                balances[row[0]] = dict(
+                    (c, float(v or 0)) for c, v in zip(CURRENCIES, row[1:]))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        changes.feed.notify(participants=totals)
+
+    for result in results:
+        if result['status'] == 'ok':
+            result['balances'] = balances[result['id']]
+
+    elapsed = time.time() - started
+    applied = sum(1 for r in results if r['status'] == 'ok')
+    return {
+        'results': results,
+        'applied': applied,
+        'failed': len(results) - applied,
+        'participants': len(totals),
+        'elapsed': elapsed,
+        'rows_per_second': len(results) / elapsed if elapsed > 0 else None,
+    }
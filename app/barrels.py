@@ -0,0 +1,146 @@
+# app/barrels.py
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+from . import changes, db, ledger
+from .models import Storage
+
+# barrels one storage unit holds unless STORAGE_CAPACITY says otherwise
+DEFAULT_CAPACITY = 800
+
+
+class StorageError(ValueError):
+    """
+    Raised when a barrel movement is malformed or targets no storage
+    """
+
+
+class StorageNotFound(StorageError):
+    """
+    Raised when the storage to move barrels for does not exist
+    """
+
+
+class CapacityExceeded(StorageError):
+    """
+    Raised when a movement would overfill or overdraw a storage
+    """
+
+
+def capacity_per_storage():
+    return current_app.config.get('STORAGE_CAPACITY', DEFAULT_CAPACITY)
+
+
+_table = Storage.__table__
+_move = _table.update().where(
+    (_table.c.id == bindparam('sid')) &
+    (_table.c.current_capacity + bindparam('barrels') >= 0) &
+    (_table.c.current_capacity + bindparam('barrels') <=
+     _table.c.stornum * bindparam('capacity'))
+).values(current_capacity=_table.c.current_capacity + bindparam('barrels'),
+         version=_table.c.version + 1)
+
+
+def _apply(storage_id, barrels, capacity):
+    """
+    Check-and-increment one storage; returns True if the row was updated
+    """
+    result = db.session.execute(
+        _move, dict(sid=storage_id, barrels=barrels, capacity=capacity))
+    return result.rowcount == 1
+
+
+def move(storage_id, barrels, reason='move'):
+    """
+    Deposit (positive) or withdraw (negative) barrels for one storage
+
+    The capacity check and the increment are one conditional UPDATE, so two
+    concurrent deposits can never both pass the check and overfill it.
+    Commits and returns the new fill.
+    """
+    barrels = int(barrels)
+    if not barrels:
+        raise StorageError('nothing to move')
+    if not _apply(storage_id, barrels, capacity_per_storage()):
+        db.session.rollback()
+        if Storage.query.get(storage_id) is None:
+            raise StorageNotFound('no storage {}'.format(storage_id))
+        raise CapacityExceeded('storage {} cannot take {} barrels'.format(
+            storage_id, barrels))
+    ledger.record(storage_id=storage_id, reason=reason, barrels=barrels)
+    db.session.commit()
+    changes.feed.notify(storages=[storage_id])
+    return db.session.query(Storage.current_capacity).filter(
+        Storage.id == storage_id).scalar()
+
+
+def move_many(moves, atomic=False, reason='move'):
+    """
+    Move barrels for many storages in one transaction
+
+    Each move is a mapping with an ``id`` or ``storown`` and ``barrels``;
+    anything else is reported invalid.
+    Every row still gets its own conditional UPDATE, which is what yields a
+    per-row result, but they share one transaction and one commit. With
+    atomic=True a single failed row rolls the whole batch back. Applied rows
+    report the storage's id and storown.
+    """
+    capacity = capacity_per_storage()
+    results = []
+    names = set(m.get('storown') for m in moves
+                if isinstance(m, dict) and m.get('id') in (None, '') and
+                isinstance(m.get('storown'), (type(''), type(u''))))
+    by_name = {}
+    if names:
+        by_name = dict(db.session.query(Storage.storown, Storage.id).filter(
+            Storage.storown.in_(list(names))))
+
+    applied = []
+    for index, entry in enumerate(moves):
+        result = {'row': index, 'status': 'ok'}
+        results.append(result)
+        if not isinstance(entry, dict):
+            result.update(status='invalid', error='not an object')
+            continue
+        try:
+            if entry.get('id') not in (None, ''):
+                storage_id = int(entry['id'])
+            else:
+                storage_id = by_name.get(entry.get('storown'))
+            barrels = int(entry.get('barrels') or 0)
+        except (TypeError, ValueError):
+            result.update(status='invalid', error='bad id or barrels')
+            continue
+        if storage_id is None:
+            result.update(status='not_found', error='no storage {}'.format(entry.get('storown')))
+            continue
+        result['id'] = storage_id
+        if not barrels:
+            result.update(status='invalid', error='nothing to move')
+        elif _apply(storage_id, barrels, capacity):
+            applied.append((storage_id, barrels))
+        else:
+            result.update(status='rejected', error='capacity exceeded or no such storage')
+
+    failed = any(r['status'] != 'ok' for r in results)
+    if not applied or (atomic and failed):
+        db.session.rollback()
+        if atomic:
+            for result in results:
+                if result['status'] == 'ok':
+                    result['status'] = 'rolled_back'
+        applied = []
+    else:
+        ledger.record_many((dict(storage_id=sid, asset=ledger.BARRELS, delta=b)
+                            for sid, b in applied), reason=reason)
+        db.session.commit()
+        changes.feed.notify(storages=[sid for sid, _ in applied])
+        owners = dict(db.session.query(Storage.id, Storage.storown).filter(
+            Storage.id.in_([sid for sid, _ in applied])))
+        for result in results:
+            if result['status'] == 'ok':
+                result['storown'] = owners.get(result['id'])
+
+    return {'results': results, 'applied': len(applied),
+            'failed': len(results) - len(applied)}
@@ -0,0 +1,270 @@
+# app/bulk.py
+
+import codecs
+import csv
+import random
+import time
+from itertools import islice
+
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+from . import barrels, changes, db, ledger
+from .conflicts import DEFAULT_ATTEMPTS
+from .models import CURRENCIES, CURRENCY_PLACES, Participant, Storage
+from .money import to_decimal
+
+DEFAULT_CHUNK = 500
+PY2 = bytes is str
+
+# table name: (model, unique name column, columns an import may set)
+TABLES = {
+    'participants': (Participant, 'partname', CURRENCIES),
+    'storages': (Storage, 'storown', ('stornum', 'current_capacity')),
+}
+
+# what the ledger calls a column, where that differs
+ASSETS = {'current_capacity': ledger.BARRELS}
+
+
+def _table(kind):
+    try:
+        return TABLES[kind]
+    except KeyError:
+        raise ValueError('cannot export or import {!r}'.format(kind))
+
+
+def columns(kind):
+    """
+    Return the CSV header for a table, as written by export_csv
+    """
+    model, name, fields = _table(kind)
+    return ('id', name) + fields
+
+
+class _Lines(object):
+    """
+    File-like target for csv.writer that hands back what was written
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, text):
+        self._parts.append(text)
+
+    def pop(self):
+        text = ''.join(self._parts)
+        self._parts = []
+        return text
+
+
+def export_csv(kind, chunk=DEFAULT_CHUNK):
+    """
+    Yield a whole table as CSV text, chunk rows at a time
+
+    Rows come off a server-side cursor (stream_results) in id order and are
+    written out as they arrive, so memory use does not grow with the table.
+    Meant to be wrapped in a streaming Response or written to a file.
+    """
+    model, name, fields = _table(kind)
+    header = columns(kind)
+    query = db.session.query(*[getattr(model, c) for c in header]).order_by(
+        model.id).execution_options(stream_results=True).yield_per(chunk)
+
+    lines = _Lines()
+    writer = csv.writer(lines)
+    writer.writerow(header)
+    for count, row in enumerate(query, 1):
+        writer.writerow(row)
+        if count % chunk == 0:
+            yield lines.pop()
+    yield lines.pop()
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, list):
+        return [_text(v) for v in value]
+    return value
+
+
+def read_csv(lines):
+    """
+    csv.DictReader over lines of text or UTF-8 bytes, e.g. a request stream
+
+    A leading byte order mark is dropped. Python 2's csv module only reads
+    byte strings, so there lines are fed to it as UTF-8 and every field is
+    decoded after; Python 3's reads text, so lines are decoded before.
+    """
+    def stripped():
+        first = True
+        for line in lines:
+            if first:
+                first = False
+                if isinstance(line, bytes):
+                    if line.startswith(codecs.BOM_UTF8):
+                        line = line[len(codecs.BOM_UTF8):]
+                else:
+                    line = line.lstrip(u'\ufeff')
+            if PY2:
+                yield line if isinstance(line, bytes) else line.encode('utf-8')
+            else:
+                yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+    reader = csv.DictReader(stripped())
+    if not PY2:
+        return reader
+    return (dict((_text(k), _text(v)) for k, v in row.items()) for row in reader)
+
+
+def _normalize(kind, index, row):
+    """
+    Validate one import row and return (name, {column: value}) or raise ValueError
+    """
+    model, name_column, fields = _table(kind)
+    name = (row.get(name_column) or '').strip()
+    if not name:
+        raise ValueError('row {} has no {}'.format(index, name_column))
+    values = {}
+    for field in fields:
+        value = row.get(field)
+        if value is None or not str(value).strip():
+            continue
+        try:
+            values[field] = to_decimal(value, CURRENCY_PLACES[field]) \
+                if kind == 'participants' else int(value)
+        except (TypeError, ValueError):
+            raise ValueError('row {}: invalid {} {!r}'.format(index, field, value))
+    return name, values
+
+
+def _upsert(kind, pending, reason):
+    """
+    Write one chunk of {name: values} without committing
+
+    Returns ({name: (id, 'inserted' or 'updated')}, {name: error}), or None
+    when a row changed since it was read: existing rows are updated with one
+    executemany that checks each row's version, and the caller rolls back
+    and tries the chunk again.
+    """
+    model, name_column, fields = _table(kind)
+    table = model.__table__
+    existing = db.session.query(
+        model.id, model.version, getattr(model, name_column),
+        *[getattr(model, f) for f in fields]
+    ).filter(getattr(model, name_column).in_(list(pending)))
+
+    updates, inserts, rejected = [], [], {}
+    for row in existing:
+        before = dict((f, value or 0) for f, value in zip(fields, row[3:]))
+        updates.append((row[2], row[0], row[1], before, dict(before, **pending.pop(row[2]))))
+    for name, values in pending.items():
+        inserts.append((name, dict(dict.fromkeys(fields, 0), **values)))
+
+    if kind == 'storages':
+        capacity = barrels.capacity_per_storage()
+        for name, after in [(u[0], u[4]) for u in updates] + inserts:
+            if not 0 <= after['current_capacity'] <= after['stornum'] * capacity:
+                rejected[name] = '{} barrels do not fit in {} storages'.format(
+                    after['current_capacity'], after['stornum'])
+        updates = [u for u in updates if u[0] not in rejected]
+        inserts = [i for i in inserts if i[0] not in rejected]
+
+    outcome, entries = {}, []
+    if updates:
+        stmt = table.update().where(
+            (table.c.id == bindparam('_id')) & (table.c.version == bindparam('_version'))
+        ).values(dict((f, bindparam(f)) for f in fields), version=table.c.version + 1)
+        params = [dict(after, _id=row_id, _version=version)
+                  for _, row_id, version, _, after in updates]
+        if db.session.execute(stmt, params).rowcount != len(params):
+            return None
+        for name, row_id, _, before, after in updates:
+            outcome[name] = (row_id, 'updated')
+            entries.append((row_id, ledger.diff(before, after)))
+    if inserts:
+        db.session.execute(table.insert(), [dict(values, **{name_column: name})
+                                            for name, values in inserts])
+        created = dict(db.session.query(getattr(model, name_column), model.id).filter(
+            getattr(model, name_column).in_([name for name, _ in inserts])))
+        for name, values in inserts:
+            outcome[name] = (created[name], 'inserted')
+            entries.append((created[name], values))
+
+    account = 'participant_id' if kind == 'participants' else 'storage_id'
+    ledger.record_many(
+        (dict([(account, row_id)], asset=ASSETS.get(f, f), delta=delta)
+         for row_id, deltas in entries for f, delta in deltas.items()
+         if ASSETS.get(f, f) in CURRENCIES + (ledger.BARRELS,)),
+        reason=reason)
+    return outcome, rejected
+
+
+def import_csv(kind, rows, chunk=DEFAULT_CHUNK, reason='import'):
+    """
+    Create or update participants or storages from CSV rows, chunk at a time
+
+    Rows are matched on partname / storown; columns left out or empty keep
+    their current value (0 for new rows). Each chunk is validated, written
+    and committed on its own, so a bad chunk does not undo the ones before
+    it and rows can be read lazily from any size of file. Returns a report
+    listing only the rows that failed.
+    """
+    _table(kind)
+    started = time.time()
+    rows = iter(rows)
+    report = {'inserted': 0, 'updated': 0, 'failed': 0, 'chunks': 0, 'errors': []}
+    index = 0
+    while True:
+        batch = list(islice(rows, chunk))
+        if not batch:
+            break
+        report['chunks'] += 1
+        # later rows for the same name win, as if applied one by one
+        pending, first_row = {}, {}
+        for offset, row in enumerate(batch):
+            try:
+                name, values = _normalize(kind, index + offset, row)
+            except ValueError as e:
+                report['failed'] += 1
+                report['errors'].append({'row': index + offset, 'error': str(e)})
+                continue
+            pending.setdefault(name, {}).update(values)
+            first_row.setdefault(name, index + offset)
+        index += len(batch)
+        if not pending:
+            continue
+
+        result, error = None, 'kept changing, gave up'
+        for attempt in range(DEFAULT_ATTEMPTS):
+            try:
+                result = _upsert(kind, dict((k, dict(v)) for k, v in pending.items()), reason)
+            except IntegrityError as e:
+                # e.g. the same name inserted concurrently
+                db.session.rollback()
+                error = str(e.orig)
+                break
+            if result is not None:
+                db.session.commit()
+                break
+            db.session.rollback()
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+        failed = result[1] if result is not None else dict.fromkeys(pending, error)
+        report['failed'] += len(failed)
+        report['errors'].extend({'row': first_row[name], 'name': name, 'error': failed[name]}
+                                for name in sorted(failed, key=first_row.get))
+        if result is None:
+            continue
+        for row_id, status in result[0].values():
+            report[status] += 1
+        ids = [row_id for row_id, _ in result[0].values()]
+        if ids:
+            changes.feed.notify(**{kind: ids})
+
+    elapsed = time.time() - started
+    report['elapsed'] = elapsed
+    report['rows_per_second'] = index / elapsed if elapsed > 0 else None
+    return report
@@ -0,0 +1,103 @@
+# app/changes.py
+
+import threading
+import time
+
+
+class ChangeFeed(object):
+    """
+    Process-local notifications about changed participants and storages
+
+    Writers call notify() after committing. Waiters (the dashboard streams)
+    register a threading.Event per row they care about, so a change wakes
+    only the connections watching that row instead of every open stream.
+    Other code can subscribe() to be called with the changed ids, e.g. to
+    drop cached copies.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._listeners = []
+        self._rate_listeners = []
+
+    def subscribe(self, listener):
+        """
+        Call listener(participants, storages) on every notify()
+        """
+        self._listeners.append(listener)
+        return listener
+
+    def subscribe_rates(self, listener):
+        """
+        Call listener() whenever exchange rates change
+        """
+        self._rate_listeners.append(listener)
+        return listener
+
+    def listen(self, keys):
+        """
+        Return an Event that is set when any of the (kind, id) keys changes
+        """
+        waiter = threading.Event()
+        with self._lock:
+            for key in keys:
+                self._waiters.setdefault(key, set()).add(waiter)
+        return waiter
+
+    def unlisten(self, waiter, keys):
+        with self._lock:
+            for key in keys:
+                waiters = self._waiters.get(key)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[key]
+
+    def notify(self, participants=(), storages=()):
+        keys = ([('participant', pid) for pid in participants] +
+                [('storage', sid) for sid in storages])
+        with self._lock:
+            waiters = set()
+            for key in keys:
+                waiters.update(self._waiters.get(key, ()))
+        for waiter in waiters:
+            waiter.set()
+        for listener in self._listeners:
+            listener(list(participants), list(storages))
+
+    def notify_rates(self):
+        for listener in self._rate_listeners:
+            listener()
+
+
+class VersionCache(object):
+    """
+    Recently seen row versions, dropped as soon as the row changes
+
+    Lets conditional GETs be answered without touching the balance tables.
+    Entries also expire after a short ttl so that writes made by other
+    processes, which this one is never notified about, still show up.
+    """
+
+    def __init__(self):
+        self._versions = {}
+
+    def get(self, key, ttl):
+        entry = self._versions.get(key)
+        if entry is not None and time.time() - entry[1] < ttl:
+            return entry[0]
+
+    def set(self, key, version):
+        self._versions[key] = (version, time.time())
+
+    def invalidate(self, participants, storages):
+        for pid in participants:
+            self._versions.pop(('participant', pid), None)
+        for sid in storages:
+            self._versions.pop(('storage', sid), None)
+
+
+feed = ChangeFeed()
+versions = VersionCache()
+feed.subscribe(versions.invalidate)
@@ -0,0 +1,84 @@
+# app/conflicts.py
+
+import random
+import time
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from . import changes, db, ledger
+from .models import CURRENCIES, CURRENCY_PLACES, Participant, Storage
+from .money import to_decimal
+
+DEFAULT_ATTEMPTS = 5
+
+
+class EditConflict(RuntimeError):
+    """
+    Raised when a row kept changing underneath an update
+    """
+
+
+def retry_on_conflict(model, row_id, change, attempts=DEFAULT_ATTEMPTS):
+    """
+    Load a row, apply change(row) and commit, again on a version conflict
+
+    Participant and Storage carry a version column that every UPDATE checks
+    and bumps, so a commit fails with StaleDataError when someone else wrote
+    the row since it was read. No lock is held in between: the change is
+    simply re-applied to a fresh copy, after a short random back-off.
+    change must therefore work from the row it is given (add a delta rather
+    than set a value computed earlier). Returns the updated row, None if
+    it does not exist, or raises EditConflict once attempts run out.
+    """
+    for attempt in range(attempts):
+        row = model.query.get(row_id)
+        if row is None:
+            return None
+        change(row)
+        try:
+            db.session.commit()
+            return row
+        except StaleDataError:
+            db.session.rollback()
+            db.session.expire_all()
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+    raise EditConflict('{} {} kept changing, gave up after {} attempts'.format(
+        model.__tablename__, row_id, attempts))
+
+
+def apply_deltas(participant_id=None, storage_id=None, reason='adjustment',
+                 attempts=DEFAULT_ATTEMPTS, **deltas):
+    """
+    Add deltas to one participant's currencies or one storage's barrels
+
+    e.g. apply_deltas(participant_id=3, usd=-20, fcd=280000). Goes through
+    retry_on_conflict and records the change in the ledger in the same
+    transaction. Returns the updated row or None.
+    """
+    if participant_id is not None:
+        model, row_id = Participant, participant_id
+        columns = dict((c, c) for c in CURRENCIES)
+        account = {'participant_id': participant_id}
+    else:
+        model, row_id = Storage, storage_id
+        columns = {ledger.BARRELS: 'current_capacity'}
+        account = {'storage_id': storage_id}
+    unknown = set(deltas) - set(columns)
+    if unknown:
+        raise ValueError('cannot adjust {}'.format(', '.join(sorted(unknown))))
+    if participant_id is not None:
+        # balances are Decimal, add exact amounts to them
+        deltas = dict((asset, to_decimal(delta, CURRENCY_PLACES[asset]))
+                      for asset, delta in deltas.items())
+
+    def change(row):
+        for asset, column in columns.items():
+            if deltas.get(asset):
+                setattr(row, column, (getattr(row, column) or 0) + deltas[asset])
+        ledger.record(reason=reason, **dict(account, **deltas))
+
+    row = retry_on_conflict(model, row_id, change, attempts)
+    if row is not None:
+        changes.feed.notify(participants=[participant_id] if participant_id else (),
+                            storages=[storage_id] if storage_id else ())
+    return row
@@ -0,0 +1,121 @@
+# app/exchange.py
+
+from decimal import ROUND_DOWN, Decimal
+
+from . import changes, db, ledger
+from .balances import to_number
+from .models import CURRENCIES, CURRENCY_PLACES, ExchangeRate, Participant
+from .money import PLACES, to_decimal
+
+# MFD is the unit every other rate is quoted in
+BASE_CURRENCY = 'fcd'
+
+
+class ExchangeError(ValueError):
+    """
+    Raised when a trade request is malformed or cannot be priced
+    """
+
+
+class InsufficientFunds(ExchangeError):
+    """
+    Raised when the participant does not hold enough of the source currency
+    """
+
+
+def get_rates():
+    """
+    Return {currency: value in MFD} for every currency with a rate
+    """
+    rates = dict(db.session.query(ExchangeRate.currency, ExchangeRate.rate))
+    rates[BASE_CURRENCY] = 1.0
+    return rates
+
+
+def set_rate(currency, rate, scheduled=False):
+    """
+    Create or update the MFD value of one unit of a currency
+
+    A rate for ``barrels`` values storage contents for the leaderboard;
+    barrels cannot be traded through exchange(). A scheduled rate waits in
+    next_rate until the current round is settled.
+    """
+    if currency not in CURRENCIES + (ledger.BARRELS,) or currency == BASE_CURRENCY:
+        raise ExchangeError('unknown currency {!r}'.format(currency))
+    if rate <= 0:
+        raise ExchangeError('rate must be positive')
+    row = ExchangeRate.query.get(currency)
+    if scheduled:
+        if row is None:
+            raise ExchangeError('no rate for {} to replace'.format(currency))
+        row.next_rate = rate
+        db.session.commit()
+        return
+    if row is None:
+        db.session.add(ExchangeRate(currency=currency, rate=rate))
+    else:
+        row.rate = rate
+    db.session.commit()
+    changes.feed.notify_rates()
+
+
+def _exact_rate(rate):
+    # rates keep their own precision, unlike amounts
+    return Decimal(repr(float(rate)))
+
+
+def quote(source, target, amount, rates=None):
+    """
+    Return how much of target currency amount of source currency buys
+
+    Worked out in Decimal and rounded down to the target's minor unit, so a
+    trade never credits a fraction of one more than the debit is worth.
+    """
+    if rates is None:
+        rates = get_rates()
+    for currency in (source, target):
+        if currency not in CURRENCIES:
+            raise ExchangeError('unknown currency {!r}'.format(currency))
+        if currency not in rates:
+            raise ExchangeError('no rate for {}'.format(currency))
+    if source == target:
+        raise ExchangeError('cannot exchange a currency for itself')
+    amount = to_decimal(amount, CURRENCY_PLACES[source])
+    if amount <= 0:
+        raise ExchangeError('amount must be positive')
+    value = amount * _exact_rate(rates[source]) / _exact_rate(rates[target])
+    return value.quantize(Decimal(1).scaleb(-CURRENCY_PLACES[target]), rounding=ROUND_DOWN)
+
+
+def exchange(participant_id, source, target, amount):
+    """
+    Convert amount of source into target for one participant
+
+    The debit, credit and balance check happen in a single conditional
+    UPDATE (``... WHERE id = :id AND source >= :amount``), so concurrent
+    trades on the same row neither lose updates nor overdraw it, and the
+    row lock is held only for the duration of that one statement.
+    """
+    amount = to_number(amount, CURRENCY_PLACES.get(source, PLACES))
+    credited = quote(source, target, amount)
+
+    source_col = getattr(Participant, source)
+    target_col = getattr(Participant, target)
+    updated = Participant.query.filter(
+        Participant.id == participant_id,
+        source_col >= amount
+    ).update({source_col: source_col - amount,
+              target_col: target_col + credited,
+              Participant.version: Participant.version + 1},
+             synchronize_session=False)
+
+    if not updated:
+        db.session.rollback()
+        raise InsufficientFunds('insufficient {} balance'.format(source))
+    ledger.record(participant_id=participant_id, reason='exchange',
+                  **{source: -amount, target: credited})
+    db.session.commit()
+    changes.feed.notify(participants=[participant_id])
+
+    return {'participant': participant_id, 'source': source,
+            'target': target, 'debited': float(amount), 'credited': float(credited)}
@@ -0,0 +1,40 @@
+# app/fragments.py
+
+from jinja2 import Markup
+
+from .cache import LRUCache
+from .changes import feed
+
+# rendered admin table rows, keyed by (kind, id) and tagged with the version
+# of the row they were rendered from. Sized from FRAGMENT_CACHE_SIZE.
+rows = LRUCache(maxsize=4096)
+
+
+def cached_row(kind, obj, macro):
+    """
+    Render macro(obj), reusing the last rendering while obj.version is unchanged
+
+    Used from templates as {{ cached_row('participant', participant, rows.participant) }}.
+    Every edit bumps the version, so a stale row is never served even before
+    the edit's notification drops it.
+    """
+    key = (kind, obj.id)
+    entry = rows.get(key)
+    if entry is not None and entry[0] == obj.version:
+        return entry[1]
+    html = Markup(macro(obj))
+    rows.set(key, (obj.version, html))
+    return html
+
+
+@feed.subscribe
+def _invalidate_rows(participants, storages):
+    for pid in participants:
+        rows.pop(('participant', pid))
+    for sid in storages:
+        rows.pop(('storage', sid))
+
+
+def init_app(app):
+    rows.configure(maxsize=app.config.get('FRAGMENT_CACHE_SIZE', 4096))
+    app.jinja_env.globals['cached_row'] = cached_row
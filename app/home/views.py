@@ -1,12 +1,62 @@
 # app/home/views.py
 
+import json
+
 from . import home
-from flask import abort, render_template
+from flask import (Response, abort, current_app, jsonify, render_template,
+                   request, stream_with_context)
 from flask_login import current_user, login_required
-from .. import db
-from ..models import Participant, Storage
+from .. import barrels, changes, db, rounds
+from ..leaderboard import board
+from ..exchange import ExchangeError, InsufficientFunds, exchange as convert
+from ..models import CURRENCIES, Participant, Storage
+from ..pages import cached_page
+from ..rates import history as rate_history
+from ..routing import read_only
+from ..stats import stats
+
+def team_ids():
+    """
+    Return (participant id, storage id) of the logged in user
+    """
+    participant_id, storage_id = current_user.userid, current_user.storid
+    if participant_id is None:
+        participant_id = db.session.query(Participant.id).filter_by(
+            partname=current_user.username).scalar()
+    if storage_id is None:
+        storage_id = db.session.query(Storage.id).filter_by(
+            storown=current_user.username).scalar()
+    if participant_id is None or storage_id is None:
+        abort(404)
+    return participant_id, storage_id
+
+def team_versions(participant_id, storage_id):
+    """
+    Return the (participant, storage) row versions in a single query
+    """
+    participant_version = db.session.query(Participant.version).filter(
+        Participant.id == participant_id).correlate(None).as_scalar()
+    storage_version = db.session.query(Storage.version).filter(
+        Storage.id == storage_id).correlate(None).as_scalar()
+    return db.session.query(participant_version, storage_version).one()
+
+def team_values(participant_id, storage_id):
+    """
+    Return the balance and storage figures shown on the dashboard
+    """
+    values = {}
+    participant = Participant.query.get(participant_id)
+    if participant is not None:
+        for currency in CURRENCIES:
+            values[currency] = float(getattr(participant, currency) or 0)
+    storage = Storage.query.get(storage_id)
+    if storage is not None:
+        values['stornum'] = storage.stornum
+        values['current_capacity'] = storage.current_capacity
+    return values
 
 @home.route('/')
+@cached_page
 def homepage():
     """
     Render the homepage template on the / route
@@ -16,13 +66,173 @@ def homepage():
 
 @home.route('/dashboard')
 @login_required
+@read_only
 def dashboard():
     """
     Render the dashboard template on the /dashboard route
     """
-    participant = Participant.query.filter_by(partname=current_user.username).first_or_404()
-    storage = Storage.query.filter_by(storown=current_user.username).first_or_404()
-    return render_template('home/dashboard.html', participant=participant , storage=storage, title="Dashboard")
+    participant, storage = current_user.participant, current_user.storage
+    if participant is None:
+        participant = Participant.query.filter_by(partname=current_user.username).first_or_404()
+    if storage is None:
+        storage = Storage.query.filter_by(storown=current_user.username).first_or_404()
+    return render_template('home/dashboard.html', participant=participant , storage=storage,
+                           storage_capacity=barrels.capacity_per_storage(),
+                           round_clock=rounds.clock(), title="Dashboard")
+
+@home.route('/dashboard/stream')
+@login_required
+def dashboard_stream():
+    """
+    Push balance and storage changes to the dashboard as Server-Sent Events
+
+    Each stream sleeps on an Event that only writes to its own rows set, and
+    re-checks the row versions every LIVE_POLL_INTERVAL seconds to pick up
+    writes made by other processes. The database connection goes back to
+    the pool while the stream is idle, so open streams cost a socket and a
+    waiting thread (or greenlet, under gevent) each.
+    """
+    participant_id, storage_id = team_ids()
+    keys = [('participant', participant_id), ('storage', storage_id)]
+    interval = current_app.config.get('LIVE_POLL_INTERVAL', 15)
+
+    def events():
+        waiter = changes.feed.listen(keys)
+        sent, versions = {}, None
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                waiter.clear()
+                current = team_versions(participant_id, storage_id)
+                if current != versions:
+                    values = team_values(participant_id, storage_id)
+                    changed = dict((k, v) for k, v in values.items()
+                                   if sent.get(k) != v)
+                    sent.update(values)
+                    versions = current
+                    if changed:
+                        yield 'event: balance\ndata: {}\n\n'.format(
+                            json.dumps(changed))
+                else:
+                    yield ': keep-alive\n\n'
+                db.session.remove()
+                waiter.wait(interval)
+        finally:
+            changes.feed.unlisten(waiter, keys)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+@home.route('/api/me')
+@login_required
+def api_me():
+    """
+    Return the dashboard figures as JSON, with an ETag built from the row
+    versions
+
+    Unchanged polls get a bare 304. Versions seen in the last API_VERSION_TTL
+    seconds are taken from memory, so most of those polls never reach the
+    balance tables at all.
+    """
+    participant_id, storage_id = team_ids()
+    keys = ('participant', participant_id), ('storage', storage_id)
+    ttl = current_app.config.get('API_VERSION_TTL', 2)
+
+    current = tuple(changes.versions.get(key, ttl) for key in keys)
+    if None in current:
+        current = team_versions(participant_id, storage_id)
+        for key, version in zip(keys, current):
+            changes.versions.set(key, version)
+
+    etag = 'p{}.{}-s{}.{}'.format(participant_id, current[0], storage_id, current[1])
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(team_values(participant_id, storage_id))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@home.route('/api/round')
+@login_required
+def api_round():
+    """
+    Return the round clock; dashboards count down from its remaining seconds
+    """
+    response = jsonify(rounds.clock())
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@home.route('/api/rates')
+@login_required
+def api_rates():
+    """
+    Return the rates of every settled round, one list per currency, plus
+    the current round's live rates
+    """
+    current, rates = rate_history.current()
+    response = jsonify(rounds=len(rate_history), series=rate_history.series(),
+                       current={'round': current, 'rates': rates})
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@home.route('/api/rates/<int:number>')
+@login_required
+def api_rates_at(number):
+    """
+    Return the rates of one round
+
+    A settled round never changes again, so browsers may keep it for good;
+    the current round is only ever answered from memory and not cached.
+    """
+    rates = rate_history.at(number)
+    if rates is None:
+        abort(404)
+    response = jsonify(round=number, rates=rates)
+    if rate_history.is_settled(number):
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@home.route('/api/leaderboard')
+@login_required
+def api_leaderboard():
+    """
+    Return the top participants by net worth, plus the caller's own rank
+    """
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    result = {'top': board.top(limit)}
+    if not current_user.is_admin:
+        participant_id, _ = team_ids()
+        mine = board.rank(participant_id)
+        if mine is not None:
+            result['me'] = dict(rank=mine[0], net_worth=mine[1], of=len(board))
+    return jsonify(result)
+
+@home.route('/exchange', methods=['POST'])
+@login_required
+def exchange():
+    """
+    Convert between currencies for the logged in participant
+
+    Expects a JSON body {"from": "fcd", "to": "usd", "amount": 1000}
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(error='expected a JSON object'), 400
+    participant_id, _ = team_ids()
+
+    try:
+        trade = convert(participant_id, payload.get('from'), payload.get('to'),
+                        payload.get('amount'))
+    except InsufficientFunds as e:
+        return jsonify(error=str(e)), 409
+    except (ExchangeError, TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(trade)
 
 # add admin dashboard view
 @home.route('/admin/dashboard')
@@ -32,4 +242,19 @@ def admin_dashboard():
     if not current_user.is_admin:
         abort(403)
 
-    return render_template('home/admin_dashboard.html', title="Dashboard")
\ No newline at end of file
+    return render_template('home/admin_dashboard.html', stats=stats.snapshot(),
+                           title="Dashboard")
+
+@home.route('/admin/dashboard/stats')
+@login_required
+@read_only
+def admin_stats():
+    """
+    Return the admin dashboard figures as JSON, for the page to poll
+    """
+    if not current_user.is_admin:
+        abort(403)
+    movers = max(1, min(request.args.get('movers', 5, type=int), 50))
+    response = jsonify(stats.snapshot(movers))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
\ No newline at end of file
@@ -0,0 +1,156 @@
+# app/leaderboard.py
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+from flask import current_app
+from sqlalchemy import BigInteger, func, or_, type_coerce
+
+from . import changes, db, exchange
+from .ledger import BARRELS
+from .models import CURRENCIES, CURRENCY_PLACES, Participant, Storage
+
+# net worths are integers in 10 ** -WORTH_PLACES MFD
+WORTH_PLACES = 8
+UNITS = 10 ** WORTH_PLACES
+
+
+def _fixed(rate, places=0):
+    """
+    The worth in UNITS of one minor unit with places decimals, at rate
+    """
+    return int(round((rate or 0) * 10 ** (WORTH_PLACES - places)))
+
+
+def to_mfd(units):
+    """
+    Convert a net worth from net_worth_columns into MFD
+    """
+    return units / float(UNITS)
+
+
+def net_worth_columns(rates):
+    """
+    Return (participant id, partname, net worth in MFD / UNITS) columns
+
+    The valuation is a single SQL expression over the balance columns plus
+    the barrels in the participant's storage, so a full recompute is one
+    pass over the tables inside the database rather than a Python loop.
+    Balances are integer minor units, each multiplied by the integer worth
+    of its minor unit, so the whole expression is integer arithmetic and
+    equal worths rank the same on every database.
+    """
+    worth = func.coalesce(Storage.current_capacity, 0) * _fixed(rates.get(BARRELS))
+    for currency in CURRENCIES:
+        minor = type_coerce(getattr(Participant, currency), BigInteger)
+        worth = worth + func.coalesce(minor, 0) * _fixed(rates.get(currency),
+                                                         CURRENCY_PLACES[currency])
+    return Participant.id, Participant.partname, worth.label('net_worth')
+
+
+def _valued(rates):
+    return db.session.query(*net_worth_columns(rates)).outerjoin(
+        Storage, Storage.storown == Participant.partname)
+
+
+class Leaderboard(object):
+    """
+    Participants ordered by net worth, kept up to date as balances change
+
+    Entries live in a sorted list of (-net worth in MFD / UNITS, id), so top-K is a slice
+    and "my rank" a binary search. A balance change re-values only the
+    touched participants and moves their entries; a rate change or an entry
+    older than LEADERBOARD_MAX_AGE seconds (writes from other processes are
+    not seen otherwise) triggers a full recompute.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ranked = []
+        self._worth = {}
+        self._names = {}
+        self._rates = None
+        self._built_at = None
+
+    def _stale(self):
+        if self._built_at is None:
+            return True
+        max_age = current_app.config.get('LEADERBOARD_MAX_AGE', 30)
+        return time.time() - self._built_at > max_age
+
+    def rebuild(self):
+        rates = exchange.get_rates()
+        rows = _valued(rates).all()
+        ranked = sorted((-int(worth or 0), pid) for pid, _, worth in rows)
+        with self._lock:
+            self._rates = rates
+            self._ranked = ranked
+            self._worth = dict((pid, -worth) for worth, pid in ranked)
+            self._names = dict((pid, name) for pid, name, _ in rows)
+            self._built_at = time.time()
+
+    def rates_changed(self):
+        if self._built_at is not None:
+            self.rebuild()
+
+    def _remove(self, pid):
+        worth = self._worth.pop(pid, None)
+        if worth is not None:
+            index = bisect_left(self._ranked, (-worth, pid))
+            if index < len(self._ranked) and self._ranked[index] == (-worth, pid):
+                del self._ranked[index]
+        self._names.pop(pid, None)
+
+    def update(self, participants=(), storages=()):
+        """
+        Re-value the given participants (and owners of the given storages)
+        """
+        if self._built_at is None or not (participants or storages):
+            return
+        criteria = []
+        if participants:
+            criteria.append(Participant.id.in_(list(participants)))
+        if storages:
+            criteria.append(Storage.id.in_(list(storages)))
+        rows = _valued(self._rates).filter(or_(*criteria)).all()
+
+        with self._lock:
+            for pid in participants:
+                self._remove(pid)
+            for pid, name, worth in rows:
+                self._remove(pid)
+                worth = int(worth or 0)
+                insort(self._ranked, (-worth, pid))
+                self._worth[pid] = worth
+                self._names[pid] = name
+
+    def _ensure(self):
+        if self._stale():
+            self.rebuild()
+
+    def top(self, limit=10):
+        self._ensure()
+        with self._lock:
+            return [dict(rank=i + 1, id=pid, partname=self._names.get(pid),
+                         net_worth=to_mfd(-worth))
+                    for i, (worth, pid) in enumerate(self._ranked[:limit])]
+
+    def rank(self, participant_id):
+        """
+        Return (1-based rank, net worth) of a participant, or None
+        """
+        self._ensure()
+        with self._lock:
+            worth = self._worth.get(participant_id)
+            if worth is None:
+                return None
+            return bisect_left(self._ranked, (-worth, participant_id)) + 1, to_mfd(worth)
+
+    def __len__(self):
+        return len(self._ranked)
+
+
+board = Leaderboard()
+changes.feed.subscribe(board.update)
+changes.feed.subscribe_rates(board.rates_changed)
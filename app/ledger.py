@@ -0,0 +1,289 @@
+# app/ledger.py
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func, or_
+
+from . import changes, db
+from .models import (CURRENCIES, CURRENCY_PLACES, LedgerEntry, LedgerSnapshot,
+                     Participant, Storage)
+from .money import MAX_PLACES, to_decimal
+from .routing import RoutingSession
+
+BARRELS = 'barrels'
+
+# how many entries an account may accumulate past its snapshot before
+# compaction folds them into a new one
+DEFAULT_SNAPSHOT_INTERVAL = 100
+
+# entries younger than this are left in the tail, so a transaction that is
+# still in flight can never end up below a snapshot it did not make it into
+DEFAULT_SNAPSHOT_LAG = 60
+
+
+def _account(participant_id, storage_id):
+    if (participant_id is None) == (storage_id is None):
+        raise ValueError('give exactly one of participant_id or storage_id')
+    if participant_id is not None:
+        return 'participant_id', participant_id, CURRENCIES
+    return 'storage_id', storage_id, (BARRELS,)
+
+
+def _amount(asset, delta):
+    """
+    A delta as the exact Decimal its balance column stores; barrels are whole
+    """
+    return to_decimal(delta, CURRENCY_PLACES.get(asset, 0))
+
+
+# called with the entries of every committed transaction, see subscribe
+_listeners = []
+
+
+def subscribe(callback):
+    """
+    Call callback(entries) after each commit that wrote ledger entries
+
+    entries are dicts with participant_id or storage_id, asset, delta and
+    reason. Rolled back entries are never passed on, so a listener can keep
+    running totals.
+    """
+    _listeners.append(callback)
+    return callback
+
+
+def _pending(entries):
+    if _listeners:
+        db.session.info.setdefault('ledger_pending', []).extend(entries)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _committed(session):
+    entries = session.info.pop('ledger_pending', None)
+    if entries:
+        for callback in _listeners:
+            callback(entries)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('ledger_pending', None)
+
+
+def record(participant_id=None, storage_id=None, reason=None, **deltas):
+    """
+    Add ledger entries for the non-zero deltas to the current session
+
+    Nothing is committed, so the entries land in the same transaction as
+    the balance change they describe.
+    """
+    _account(participant_id, storage_id)
+    now = datetime.utcnow()
+    entries = []
+    for asset, delta in deltas.items():
+        if delta:
+            entry = dict(participant_id=participant_id, storage_id=storage_id,
+                         asset=asset, delta=_amount(asset, delta), reason=reason)
+            db.session.add(LedgerEntry(created_at=now, **entry))
+            entries.append(entry)
+    _pending(entries)
+
+
+def record_many(entries, reason=None):
+    """
+    Insert many entries with a single executemany
+
+    Each entry is a dict with participant_id or storage_id, asset and delta.
+    """
+    now = datetime.utcnow()
+    rows = []
+    for entry in entries:
+        if entry['delta']:
+            rows.append(dict(participant_id=entry.get('participant_id'),
+                             storage_id=entry.get('storage_id'),
+                             asset=entry['asset'],
+                             delta=_amount(entry['asset'], entry['delta']),
+                             reason=entry.get('reason', reason), created_at=now))
+    if rows:
+        db.session.execute(LedgerEntry.__table__.insert(), rows)
+        _pending(rows)
+
+
+def diff(before, after):
+    """
+    Return {field: after - before} for every field in after, as exact Decimals
+    """
+    return dict((k, to_decimal(after[k] or 0, MAX_PLACES) -
+                 to_decimal(before.get(k) or 0, MAX_PLACES)) for k in after)
+
+
+def record_participant(participant, reason=None, sign=1):
+    """
+    Record the full balances of a participant, e.g. when it is opened or closed
+    """
+    record(participant_id=participant.id, reason=reason,
+           **dict((c, sign * (getattr(participant, c) or 0)) for c in CURRENCIES))
+
+
+def record_storage(storage, reason=None, sign=1):
+    """
+    Record the full barrel fill of a storage
+    """
+    record(storage_id=storage.id, reason=reason,
+           barrels=sign * (storage.current_capacity or 0))
+
+
+def _latest_snapshot(column, account_id):
+    return LedgerSnapshot.query.filter(
+        getattr(LedgerSnapshot, column) == account_id
+    ).order_by(LedgerSnapshot.ledger_id.desc()).first()
+
+
+def _fold(column, account_id, assets, upto_id=None):
+    """
+    Return (balances, snapshot) for an account: snapshot plus tail
+    """
+    snapshot = _latest_snapshot(column, account_id)
+    balances = dict((a, getattr(snapshot, a) if snapshot else 0) for a in assets)
+
+    tail = db.session.query(LedgerEntry.asset, func.sum(LedgerEntry.delta)).filter(
+        getattr(LedgerEntry, column) == account_id)
+    if snapshot is not None:
+        # every entry after the snapshot is at least as new as its cutoff,
+        # which keeps this a short range scan on (account, created_at)
+        tail = tail.filter(LedgerEntry.created_at >= snapshot.created_at,
+                           LedgerEntry.id > snapshot.ledger_id)
+    if upto_id is not None:
+        tail = tail.filter(LedgerEntry.id <= upto_id)
+
+    for asset, total in tail.group_by(LedgerEntry.asset):
+        if asset in balances:
+            balances[asset] = (balances[asset] or 0) + (total or 0)
+    return balances, snapshot
+
+
+def balance(participant_id=None, storage_id=None):
+    """
+    Current balances of an account as recorded in the ledger
+    """
+    column, account_id, assets = _account(participant_id, storage_id)
+    return _fold(column, account_id, assets)[0]
+
+
+def balance_at(when, participant_id=None, storage_id=None):
+    """
+    Balances of an account as they were at the given UTC datetime
+    """
+    column, account_id, assets = _account(participant_id, storage_id)
+    totals = db.session.query(LedgerEntry.asset, func.sum(LedgerEntry.delta)).filter(
+        getattr(LedgerEntry, column) == account_id,
+        LedgerEntry.created_at <= when
+    ).group_by(LedgerEntry.asset)
+    balances = dict.fromkeys(assets, 0)
+    for asset, total in totals:
+        if asset in balances:
+            balances[asset] = total or 0
+    return balances
+
+
+def restore(when, participant_id=None, storage_id=None):
+    """
+    Reset an account to its balances at the given time
+
+    The reset itself goes through the ledger as compensating entries, so
+    undoing a bad edit stays on the record too. Commits the change.
+    """
+    column, account_id, assets = _account(participant_id, storage_id)
+    model = Participant if participant_id is not None else Storage
+    row = model.query.get(account_id)
+    if row is None:
+        raise ValueError('no {} {}'.format(model.__tablename__, account_id))
+    target = balance_at(when, participant_id, storage_id)
+
+    if model is Participant:
+        before = dict((c, getattr(row, c)) for c in CURRENCIES)
+        for currency in CURRENCIES:
+            setattr(row, currency, target[currency])
+        record(participant_id=row.id, reason='restore', **diff(before, target))
+    else:
+        before = {BARRELS: row.current_capacity}
+        row.current_capacity = int(target[BARRELS])
+        record(storage_id=row.id, reason='restore', **diff(before, target))
+    db.session.commit()
+    changes.feed.notify(participants=[participant_id] if participant_id else (),
+                        storages=[storage_id] if storage_id else ())
+    return target
+
+
+def compact(interval=None, lag=None):
+    """
+    Fold long ledger tails into fresh snapshots and drop the old ones
+
+    Meant to run periodically (see ``flask admin compact-ledger``); it keeps the
+    tail read by balance() shorter than the configured interval no matter
+    how long the ledger grows. Returns the number of snapshots written.
+    """
+    config = current_app.config
+    if interval is None:
+        interval = config.get('LEDGER_SNAPSHOT_INTERVAL', DEFAULT_SNAPSHOT_INTERVAL)
+    if lag is None:
+        lag = config.get('LEDGER_SNAPSHOT_LAG', DEFAULT_SNAPSHOT_LAG)
+
+    cutoff = datetime.utcnow() - timedelta(seconds=lag)
+    cutoff_id = db.session.query(func.max(LedgerEntry.id)).filter(
+        LedgerEntry.created_at < cutoff).scalar()
+    if cutoff_id is None:
+        return 0
+
+    written = 0
+    for column, assets in (('participant_id', CURRENCIES), ('storage_id', (BARRELS,))):
+        entry_account = getattr(LedgerEntry, column)
+        snapshots = db.session.query(
+            getattr(LedgerSnapshot, column).label('account'),
+            func.max(LedgerSnapshot.ledger_id).label('ledger_id')
+        ).filter(getattr(LedgerSnapshot, column).isnot(None)).group_by(
+            getattr(LedgerSnapshot, column)).subquery()
+        due = db.session.query(entry_account).outerjoin(
+            snapshots, snapshots.c.account == entry_account
+        ).filter(
+            entry_account.isnot(None),
+            LedgerEntry.id <= cutoff_id,
+            or_(snapshots.c.ledger_id.is_(None),
+                LedgerEntry.id > snapshots.c.ledger_id)
+        ).group_by(entry_account).having(func.count(LedgerEntry.id) >= interval)
+
+        for account_id, in due.all():
+            balances, _ = _fold(column, account_id, assets, upto_id=cutoff_id)
+            if BARRELS in balances:
+                balances[BARRELS] = int(balances[BARRELS] or 0)
+            snapshot = LedgerSnapshot(ledger_id=cutoff_id, created_at=cutoff,
+                                      **balances)
+            setattr(snapshot, column, account_id)
+            db.session.add(snapshot)
+            db.session.flush()
+            LedgerSnapshot.query.filter(
+                getattr(LedgerSnapshot, column) == account_id,
+                LedgerSnapshot.id != snapshot.id
+            ).delete(synchronize_session=False)
+            written += 1
+
+    db.session.commit()
+    return written
+
+
+def verify():
+    """
+    Yield (kind, id, live, recorded) for accounts whose columns drifted
+    from the ledger
+    """
+    for participant in Participant.query.all():
+        live = dict((c, getattr(participant, c) or 0) for c in CURRENCIES)
+        recorded = balance(participant_id=participant.id)
+        if any(live[c] != (recorded[c] or 0) for c in CURRENCIES):
+            yield 'participant', participant.id, live, recorded
+    for storage in Storage.query.all():
+        live = {BARRELS: storage.current_capacity or 0}
+        recorded = balance(storage_id=storage.id)
+        if live[BARRELS] != (recorded[BARRELS] or 0):
+            yield 'storage', storage.id, live, recorded
@@ -0,0 +1,243 @@
+# app/metrics.py
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import _request_ctx_stack, current_app, g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds of the histogram buckets
+SECONDS_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# per request timings, in the order they are reported
+TIMINGS = ('request', 'sql', 'render', 'hash')
+
+
+class Histogram(object):
+    """
+    Cumulative bucket counts, sum and count of observed values
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Return (upper bound, count of values <= bound) pairs, ending in +Inf
+        """
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, fraction):
+        """
+        Upper bound of the bucket holding the given quantile
+        """
+        if not self.count:
+            return 0.0
+        for bound, total in self.cumulative():
+            if total >= fraction * self.count:
+                return bound
+
+
+class Registry(object):
+    """
+    Per-endpoint histograms and suspected N+1 statements, process-local
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.histograms = {}
+        # (endpoint, statement) -> [requests it was flagged in, max repeats]
+        self.repeats = {}
+
+    def _histogram(self, name, endpoint):
+        key = (name, endpoint)
+        if key not in self.histograms:
+            buckets = QUERY_BUCKETS if name == 'queries' else SECONDS_BUCKETS
+            self.histograms[key] = Histogram(buckets)
+        return self.histograms[key]
+
+    def observe(self, endpoint, timings, queries, repeated):
+        with self._lock:
+            for name, value in timings.items():
+                self._histogram(name, endpoint).observe(value)
+            self._histogram('queries', endpoint).observe(queries)
+            for statement, times in repeated:
+                entry = self.repeats.setdefault((endpoint, statement), [0, 0])
+                entry[0] += 1
+                entry[1] = max(entry[1], times)
+
+    def endpoints(self):
+        """
+        Rows for the admin page, slowest endpoints (by p95) first
+        """
+        with self._lock:
+            rows = []
+            for (name, endpoint), latency in self.histograms.items():
+                if name != 'request':
+                    continue
+                row = dict(endpoint=endpoint, requests=latency.count)
+                for key, fraction in (('p50', .5), ('p95', .95), ('p99', .99)):
+                    # None when it fell past the last bucket
+                    bound = latency.quantile(fraction)
+                    row[key] = None if bound == float('inf') else bound
+                for timing in TIMINGS[1:] + ('queries',):
+                    histogram = self.histograms.get((timing, endpoint))
+                    row[timing] = histogram.sum / histogram.count if histogram else 0
+                rows.append(row)
+        return sorted(rows, key=lambda row: -(row['p95'] or float('inf')))
+
+    def n_plus_one(self):
+        with self._lock:
+            return sorted(((endpoint, statement, flagged, times)
+                           for (endpoint, statement), (flagged, times)
+                           in self.repeats.items()), key=lambda row: -row[2])
+
+    def prometheus(self, prefix='bccipfest'):
+        """
+        The histograms in Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            names = sorted(set(name for name, _ in self.histograms))
+            for name in names:
+                metric = '{}_{}'.format(prefix, name if name == 'queries'
+                                        else name + '_seconds')
+                lines.append('# TYPE {} histogram'.format(metric))
+                for (other, endpoint), histogram in sorted(self.histograms.items()):
+                    if other != name:
+                        continue
+                    label = 'endpoint="{}"'.format(endpoint)
+                    for bound, total in histogram.cumulative():
+                        le = '+Inf' if bound == float('inf') else repr(float(bound))
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                            metric, label, le, total))
+                    lines.append('{}_sum{{{}}} {!r}'.format(metric, label, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(metric, label, histogram.count))
+            metric = '{}_n_plus_one_total'.format(prefix)
+            lines.append('# TYPE {} counter'.format(metric))
+            flagged = {}
+            for (endpoint, _), (count, _) in self.repeats.items():
+                flagged[endpoint] = flagged.get(endpoint, 0) + count
+            for endpoint, count in sorted(flagged.items()):
+                lines.append('{}{{endpoint="{}"}} {}'.format(metric, endpoint, count))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def _current():
+    if has_request_context():
+        return getattr(g, '_metrics', None)
+
+
+@contextmanager
+def timer(name):
+    """
+    Add the time spent in the block to the current request's timing name
+    """
+    started = time.time()
+    try:
+        yield
+    finally:
+        current = _current()
+        if current is not None:
+            current[name] = current.get(name, 0.0) + time.time() - started
+
+
+class TimedTemplate(Template):
+    """
+    Jinja template that counts its rendering towards the request's render time
+    """
+
+    def render(self, *args, **kwargs):
+        with timer('render'):
+            return Template.render(self, *args, **kwargs)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['_metrics_started'] = time.time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('_metrics_started', None)
+    current = _current()
+    if current is not None and started is not None:
+        current['sql'] += time.time() - started
+        statements = current['statements']
+        statements[statement] = statements.get(statement, 0) + 1
+
+
+def _start():
+    g._metrics = {'started': time.time(), 'sql': 0.0, 'render': 0.0,
+                  'hash': 0.0, 'statements': {}}
+
+
+def _finish(response):
+    current = getattr(g, '_metrics', None)
+    if current is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    timings = dict((name, current.get(name, 0.0)) for name in TIMINGS)
+    timings['request'] = time.time() - current['started']
+    statements = current['statements']
+    threshold = current_app.config.get('METRICS_N_PLUS_ONE', 10)
+    repeated = [(s, n) for s, n in statements.items() if n >= threshold]
+    for statement, times in repeated:
+        current_app.logger.warning('possible N+1 in %s: %d x %s',
+                                   endpoint, times, statement.split('\n')[0][:200])
+    registry.observe(endpoint, timings, sum(statements.values()), repeated)
+    if _show_timings():
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.1f}'.format(name, timings[name] * 1000) for name in TIMINGS)
+    return response
+
+
+def _show_timings():
+    """
+    Whether to send Server-Timing: with METRICS_SERVER_TIMING, or to admins
+
+    Only a user the request already loaded is looked at, so responses that
+    never touched the session (e.g. static files) do not start to.
+    """
+    if current_app.config.get('METRICS_SERVER_TIMING', False):
+        return True
+    user = getattr(_request_ctx_stack.top, 'user', None)
+    return bool(getattr(user, 'is_admin', False))
+
+
+def init_app(app):
+    """
+    Time every request, its SQL, template rendering and password hashing
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(_start)
+    app.after_request(_finish)
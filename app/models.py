@@ -1,10 +1,22 @@
 # app/models.py
 
+from datetime import datetime
+
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import joinedload
 
 from app import db, login_manager
+from . import passwords
+from .cache import LRUCache
+from .changes import feed
+from .money import MAX_PLACES, PLACES, Money
 
+# balance columns of Participant
+CURRENCIES = ('fcd', 'usd', 'sar', 'rub', 'yen')
+# decimals each is kept to: a unit of the others is worth thousands of MFD,
+# so their hundredths would still be real money
+CURRENCY_PLACES = {'fcd': PLACES, 'usd': MAX_PLACES, 'sar': MAX_PLACES,
+                   'rub': MAX_PLACES, 'yen': MAX_PLACES}
 
 
 class User(UserMixin, db.Model):
@@ -21,6 +33,8 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(60), index=True, unique=True)
     password_hash = db.Column(db.String(128))
     is_admin = db.Column(db.Boolean, default=False)
+    # banned teams can neither log in nor keep using a session
+    disabled = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
     userid = db.Column(db.Integer, db.ForeignKey('participants.id'))
     storid = db.Column(db.Integer, db.ForeignKey('storages.id'))
 
@@ -36,22 +50,88 @@ class User(UserMixin, db.Model):
         """
         Set password to a hashed password
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.generate(password)
+
+    @property
+    def is_active(self):
+        return not self.disabled
 
     def verify_password(self, password):
         """
         Check if hashed password matches actual password
         """
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify(self.password_hash, password)
+
+    def rehash_password(self, password):
+        """
+        Re-hash a verified password if its hash uses outdated parameters
+
+        Returns True when password_hash changed and needs to be committed.
+        """
+        if not passwords.needs_rehash(self.password_hash):
+            return False
+        self.password = password
+        return True
 
     def __repr__(selfEmployee):
         return '<User: {}>'.format(self.username)
 
 
+# Logged in users with their participant and storage, detached from any
+# session. Sized and timed from PRINCIPAL_CACHE_SIZE/TTL in create_app.
+principal_cache = LRUCache()
+# ('participant' | 'storage', id) -> id of the user owning that row
+_principal_owners = {}
+
+
+def invalidate_principal(user_id):
+    """
+    Drop a user from the principal cache, e.g. after its row changed
+    """
+    principal_cache.pop(user_id)
+
+
+@feed.subscribe
+def _invalidate_principals(participants, storages):
+    for key in ([('participant', pid) for pid in participants] +
+                [('storage', sid) for sid in storages]):
+        user_id = _principal_owners.pop(key, None)
+        if user_id is not None:
+            principal_cache.pop(user_id)
+
+
 # Set up user_loader
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """
+    Load a user together with its participant and storage
+
+    A cache miss costs one joined query through userid/storid; a hit costs
+    none. Cached objects are merged into the request session without a
+    load, so they behave like freshly queried ones.
+    """
+    user_id = int(user_id)
+    user = principal_cache.get(user_id)
+    if user is None:
+        user = User.query.options(joinedload(User.participant),
+                                  joinedload(User.storage)).get(user_id)
+        if user is None or user.disabled:
+            return None
+        for obj in (user, user.participant, user.storage):
+            if obj is not None:
+                db.session.expunge(obj)
+        principal_cache.set(user_id, user)
+        if user.userid is not None:
+            _principal_owners[('participant', user.userid)] = user_id
+        if user.storid is not None:
+            _principal_owners[('storage', user.storid)] = user_id
+    return db.session.merge(user, load=False)
+
+def next_version(version):
+    """
+    Version for a row being written; rows start at 0 like the server default
+    """
+    return 0 if version is None else version + 1
 
 class Participant(db.Model):
     """
@@ -65,13 +145,24 @@ class Participant(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     partname = db.Column(db.String(60), index=True, unique=True)
-    fcd = db.Column(db.Numeric, default=0)
-    usd = db.Column(db.Float(20,6), default=0)
-    sar = db.Column(db.Float(20,6), default=0)
-    rub = db.Column(db.Float(20,6), default=0)
-    yen = db.Column(db.Float(20,6), default=0)
+    # stored as integer minor units, read and written as Decimal. Only fcd
+    # is indexed, (fcd, id) for the admin list's keyset pages: every index
+    # is another write on each trade and adjustment.
+    fcd = db.Column(Money(CURRENCY_PLACES['fcd']), default=0)
+    usd = db.Column(Money(CURRENCY_PLACES['usd']), default=0)
+    sar = db.Column(Money(CURRENCY_PLACES['sar']), default=0)
+    rub = db.Column(Money(CURRENCY_PLACES['rub']), default=0)
+    yen = db.Column(Money(CURRENCY_PLACES['yen']), default=0)
+    # checked and bumped by every ORM UPDATE, so a commit based on a stale
+    # read fails with StaleDataError instead of overwriting newer values.
+    # Set-based UPDATEs must add ``version = version + 1`` themselves.
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     users = db.relationship('User', backref='participant', lazy='dynamic')
 
+    __table_args__ = (db.Index('ix_participants_fcd_id', 'fcd', 'id'),)
+    __mapper_args__ = {'version_id_col': version,
+                       'version_id_generator': next_version}
+
     def __repr__(self):
         return '<Participant: {}>'.format(self.partname)
 
@@ -89,7 +180,170 @@ class Storage(db.Model):
     storown = db.Column(db.String(60), index=True, unique=True)
     stornum = db.Column(db.Integer, default=0)
     current_capacity = db.Column(db.Integer, default=0)
+    # see Participant.version
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     users = db.relationship('User', backref='storage', lazy='dynamic')
 
+    # (current_capacity, id) for the admin list's keyset pages
+    __table_args__ = (db.Index('ix_storages_current_capacity_id', 'current_capacity', 'id'),)
+    __mapper_args__ = {'version_id_col': version,
+                       'version_id_generator': next_version}
+
+    def __repr__(self):
+        return '<Storage: {}>'.format(self.storwown)
+
+class ExchangeRate(db.Model):
+    """
+    Create rates table
+
+    One row per currency holding its value in MFD
+    """
+
+    __tablename__ = 'rates'
+
+    currency = db.Column(db.String(8), primary_key=True)
+    rate = db.Column(db.Float, nullable=False, default=1)
+    # takes over from rate when the current round is settled
+    next_rate = db.Column(db.Float)
+
+    def __repr__(self):
+        return '<ExchangeRate: {} {}>'.format(self.currency, self.rate)
+
+class GameRound(db.Model):
+    """
+    Create rounds table
+
+    One row per round; the highest number is the current round
+    """
+
+    __tablename__ = 'rounds'
+
+    number = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    # set, in the same transaction, by whoever settles the round
+    settled_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<GameRound: {}>'.format(self.number)
+
+class RoundRate(db.Model):
+    """
+    Create rate_history table
+
+    The MFD rates in effect during one settled round, one column per
+    currency, written once when the round is settled and never changed
+    """
+
+    __tablename__ = 'rate_history'
+
+    round = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    usd = db.Column(db.Float)
+    sar = db.Column(db.Float)
+    rub = db.Column(db.Float)
+    yen = db.Column(db.Float)
+    barrels = db.Column(db.Float)
+
+    def __repr__(self):
+        return '<RoundRate: {}>'.format(self.round)
+
+class LedgerEntry(db.Model):
+    """
+    Create ledger table
+
+    Append-only record of every currency and barrel movement. The account
+    columns deliberately carry no foreign key, so history outlives deleted
+    participants and storages.
+    """
+
+    __tablename__ = 'ledger'
+    __table_args__ = (
+        db.Index('ix_ledger_participant_created', 'participant_id', 'created_at'),
+        db.Index('ix_ledger_storage_created', 'storage_id', 'created_at'),
+        # this round's movements for the admin dashboard, see app.stats
+        db.Index('ix_ledger_created', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    participant_id = db.Column(db.Integer)
+    storage_id = db.Column(db.Integer)
+    asset = db.Column(db.String(8), nullable=False)
+    # every asset shares the column, so it keeps the most places any has
+    delta = db.Column(Money(MAX_PLACES), nullable=False)
+    reason = db.Column(db.String(32))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<LedgerEntry: {} {} {}>'.format(self.id, self.asset, self.delta)
+
+class LedgerSnapshot(db.Model):
+    """
+    Create ledger_snapshots table
+
+    Balances of one account folded up to and including ledger_id
+    """
+
+    __tablename__ = 'ledger_snapshots'
+
+    id = db.Column(db.Integer, primary_key=True)
+    participant_id = db.Column(db.Integer, index=True)
+    storage_id = db.Column(db.Integer, index=True)
+    ledger_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    fcd = db.Column(Money(CURRENCY_PLACES['fcd']), default=0)
+    usd = db.Column(Money(CURRENCY_PLACES['usd']), default=0)
+    sar = db.Column(Money(CURRENCY_PLACES['sar']), default=0)
+    rub = db.Column(Money(CURRENCY_PLACES['rub']), default=0)
+    yen = db.Column(Money(CURRENCY_PLACES['yen']), default=0)
+    barrels = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return '<LedgerSnapshot: {}>'.format(self.ledger_id)
+
+class AuditEvent(db.Model):
+    """
+    Create audit_log table
+
+    Who changed what through the admin pages, written in batches by
+    app.audit. Like the ledger it has no foreign keys, so it outlives the
+    rows it describes.
+    """
+
+    __tablename__ = 'audit_log'
+    __table_args__ = (
+        db.Index('ix_audit_log_partname_created', 'partname', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    actor_id = db.Column(db.Integer)
+    actor = db.Column(db.String(60))
+    action = db.Column(db.String(32), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)
+    target_id = db.Column(db.Integer)
+    # participant the change concerns; storages are named after their owner
+    partname = db.Column(db.String(60))
+    details = db.Column(db.Text)
+
+    def __repr__(self):
+        return '<AuditEvent: {} {} {}>'.format(self.action, self.kind, self.target_id)
+
+class Revocation(db.Model):
+    """
+    Create revocations table
+
+    Signed session claims that must no longer be accepted, see app.tokens.
+    A row is only needed until the claims it revokes would have expired
+    anyway, so the table stays small.
+    """
+
+    __tablename__ = 'revocations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # "jti:<claim id>" for one session, "user:<id>" for every earlier one
+    key = db.Column(db.String(40), nullable=False)
+    revoked_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
     def __repr__(self):
-        return '<Storage: {}>'.format(self.storwown)    
\ No newline at end of file
+        return '<Revocation: {}>'.format(self.key)
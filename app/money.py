@@ -0,0 +1,157 @@
+# app/money.py
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from flask import current_app, has_app_context
+from sqlalchemy.types import BigInteger, TypeDecorator
+
+# balances are stored as integers of minor units: hundredths by default,
+# and up to millionths for currencies worth thousands of MFD a unit, see
+# models.CURRENCY_PLACES
+PLACES = 2
+MAX_PLACES = 6
+# the most minor units a BIGINT holds
+MAX_MINOR = 2 ** 63 - 1
+
+# (grouping separator, decimal separator) per MONEY_LOCALE
+SEPARATORS = {
+    'en': (',', '.'),
+    'id': ('.', ','),
+}
+DEFAULT_LOCALE = 'en'
+
+
+class AmountError(ValueError):
+    """
+    Raised when a submitted amount cannot be read
+    """
+
+
+def separators(locale=None):
+    if locale is None:
+        locale = current_app.config.get('MONEY_LOCALE', DEFAULT_LOCALE) \
+            if has_app_context() else DEFAULT_LOCALE
+    try:
+        return SEPARATORS[locale]
+    except KeyError:
+        raise AmountError('unknown money locale {!r}'.format(locale))
+
+
+def parse_minor(text, places=PLACES, locale=None):
+    """
+    Read "1,250.5" (or "1.250,5" for MONEY_LOCALE 'id') as 125050 minor units
+
+    Plain string handling, no float or eval on the way: grouping separators
+    and spaces are dropped, the decimal separator splits off at most places
+    digits, and anything else is an AmountError.
+    """
+    group, point = separators(locale)
+    text = text.strip().replace(' ', '').replace(u'\u00a0', '').replace(group, '')
+    negative = text[:1] == '-'
+    if text[:1] in ('-', '+'):
+        text = text[1:]
+    whole, _, fraction = text.partition(point)
+    if not (whole or fraction) or (whole and not whole.isdigit()) or \
+            (fraction and not fraction.isdigit()) or len(fraction) > places:
+        raise AmountError('invalid amount {!r}'.format(text))
+    minor = int(whole or 0) * 10 ** places + int(fraction.ljust(places, '0') or 0)
+    return -minor if negative else minor
+
+
+def parse_amount(text, places=PLACES, locale=None):
+    """
+    Read a submitted amount as an exact Decimal, see parse_minor
+    """
+    return _checked(Decimal(parse_minor(text, places, locale)).scaleb(-places), text, places)
+
+
+def _checked(amount, value, places):
+    """
+    Return amount if a Money(places) column can hold it, else raise AmountError
+
+    Compared before any arithmetic, which could otherwise trap on NaN or
+    overflow the decimal context.
+    """
+    if not amount.is_finite():
+        raise AmountError('invalid amount {!r}'.format(value))
+    if abs(amount) > Decimal(MAX_MINOR).scaleb(-places):
+        raise AmountError('amount {!r} is out of range'.format(value))
+    return amount
+
+
+def to_decimal(value, places=PLACES):
+    """
+    Exact Decimal of a number or submitted string, rounded to places decimals
+
+    NaN, infinities and amounts beyond what a Money(places) column holds
+    raise AmountError.
+    """
+    if isinstance(value, Decimal):
+        amount = value
+    elif isinstance(value, float):
+        # repr is the shortest string that round-trips, so 0.1 stays 0.1
+        amount = Decimal(repr(value))
+    elif isinstance(value, int) or type(value).__name__ == 'long':
+        amount = Decimal(value)
+    else:
+        return parse_amount(str(value), places)
+    return _checked(amount, value, places).quantize(
+        Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+
+
+def to_minor(value, places=PLACES):
+    return int(to_decimal(value, places).scaleb(places))
+
+
+class Money(TypeDecorator):
+    """
+    An amount held as a BIGINT of minor units and read back as a Decimal
+
+    Python code keeps working in whole units while the database only ever
+    sees integers, so sums, comparisons and ORDER BY are exact. Bound
+    values in expressions against a Money column (``fcd >= :amount``,
+    ``fcd + :delta``) are converted too; multiply by anything that is not
+    an amount only after type_coerce(column, BigInteger). Money(6) keeps
+    millionths.
+    """
+
+    impl = BigInteger
+
+    def __init__(self, places=PLACES):
+        super(Money, self).__init__()
+        self.places = places
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_minor(value, self.places)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Decimal(value).scaleb(-self.places)
+
+
+def format_money(value, locale=None, places=None):
+    """
+    "1,250.50" for 1250.5, with the separators of MONEY_LOCALE
+
+    Without places, as many decimals as the amount needs, at least PLACES
+    and at most MAX_PLACES: "0.000125" but "1.50" for 1.500000.
+    """
+    if value is None or value == '':
+        return ''
+    if places is None:
+        exponent = to_decimal(value, MAX_PLACES).normalize().as_tuple().exponent
+        places = min(MAX_PLACES, max(PLACES, -exponent))
+    text = '{:,.{}f}'.format(to_decimal(value, places), places)
+    group, point = separators(locale)
+    if (group, point) != (',', '.'):
+        text = text.replace(',', '\0').replace('.', point).replace('\0', group)
+    return text
+
+
+def init_app(app):
+    app.jinja_env.filters['money'] = format_money
+    app.jinja_env.globals['money_separators'] = separators
+    app.jinja_env.globals['money_max_places'] = MAX_PLACES
@@ -0,0 +1,135 @@
+# app/pages.py
+
+import binascii
+import os
+import struct
+import zlib
+from functools import wraps
+
+from flask import Response, current_app, g, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+from .cache import LRUCache
+
+# rendered anonymous pages by path, sized from PAGE_CACHE_SIZE and kept for
+# PAGE_CACHE_TTL seconds, which also picks up a new asset build
+pages = LRUCache(maxsize=64, ttl=300)
+
+# stands in for the CSRF token while a page is rendered for the cache
+PLACEHOLDER = binascii.hexlify(os.urandom(16))
+# gzip header without a file name or time, and with "unknown" OS
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+DEFAULT_MAX_AGE = 60
+
+
+def _deflate(data, last):
+    """
+    Raw deflate data so that the results of several calls can be joined
+
+    A full flush ends a part on a byte boundary without back references,
+    which is what lets a token deflated per request go between two parts.
+    """
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+
+
+def _gzip(body, deflated):
+    return GZIP_HEADER + deflated + struct.pack(
+        '<II', zlib.crc32(body) & 0xffffffff, len(body) & 0xffffffff)
+
+
+def _field():
+    return current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')
+
+
+class CachedPage(object):
+    """
+    A rendered page split around its CSRF tokens, every part compressed ahead
+
+    Serving it costs joining the parts around the session's token and, for
+    gzip, deflating the token and a CRC of the page: no template is rendered
+    and the page is never compressed again. Pages without a form hold no
+    token and are sent as they are.
+    """
+
+    def __init__(self, body, mimetype):
+        self.parts = body.split(PLACEHOLDER)
+        self.deflated = [_deflate(part, i == len(self.parts) - 1)
+                         for i, part in enumerate(self.parts)]
+        self.mimetype = mimetype
+
+    @property
+    def shared(self):
+        """
+        Whether the page is the same for everyone, i.e. holds no token
+        """
+        return len(self.parts) == 1
+
+    def body(self, token=b''):
+        return token.join(self.parts)
+
+    def gzipped(self, token=b''):
+        return _gzip(self.body(token), _deflate(token, False).join(self.deflated))
+
+    def response(self):
+        token = b'' if self.shared else generate_csrf().encode('ascii')
+        compressed = request.accept_encodings['gzip']
+        response = Response(self.gzipped(token) if compressed else self.body(token),
+                            mimetype=self.mimetype)
+        if compressed:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        if self.shared:
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config.get(
+                'PAGE_CACHE_MAX_AGE', DEFAULT_MAX_AGE)
+        else:
+            # the token belongs to one session
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def _cacheable():
+    return current_app.config.get('PAGE_CACHE', not current_app.debug) and \
+        request.method == 'GET' and '_flashes' not in session and \
+        not current_user.is_authenticated
+
+
+def cached_page(view):
+    """
+    Serve a view's GET responses to anonymous users from the page cache
+
+    The page is rendered once per path, with a placeholder for the CSRF
+    token, and later requests get it with their own token spliced in. Only
+    for views whose page depends on nothing but the path: not the query
+    string, and not the user, though pages with flashed messages are always
+    rendered.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _cacheable():
+            return view(*args, **kwargs)
+        page = pages.get(request.path)
+        if page is None:
+            setattr(g, _field(), PLACEHOLDER.decode('ascii'))
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            finally:
+                g.pop(_field(), None)
+            if response.status_code != 200 or response.mimetype != 'text/html' or \
+                    response.is_streamed:
+                if not response.is_streamed:
+                    response.set_data(response.get_data().replace(
+                        PLACEHOLDER, generate_csrf().encode('ascii')))
+                return response
+            page = CachedPage(response.get_data(), response.mimetype)
+            pages.set(request.path, page)
+        return page.response()
+    return wrapper
+
+
+def init_app(app):
+    pages.configure(maxsize=app.config.get('PAGE_CACHE_SIZE', 64),
+                    ttl=app.config.get('PAGE_CACHE_TTL', 300))
@@ -0,0 +1,103 @@
+# app/pagination.py
+
+import base64
+import json
+from decimal import Decimal
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(value, id):
+    if isinstance(value, Decimal):
+        value = float(value)
+    raw = json.dumps([value, id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return the (value, id) pair packed into a cursor, or None if invalid
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        value, id = json.loads(raw.decode('utf-8'))
+        return value, int(id)
+    except (TypeError, ValueError):
+        return None
+
+
+class KeysetPage(object):
+    """
+    One page of a keyset paginated query
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_page(query, sort_column, id_column, descending=False,
+                after=None, before=None, per_page=50):
+    """
+    Fetch the page of query that follows cursor after, or precedes before
+
+    Rows are ordered by (sort_column, id_column), and the page boundary is
+    a seek predicate on that pair rather than an OFFSET. Every page is an
+    index range scan of per_page + 1 rows, however deep into the table it
+    is. Cursors come from the returned page's next_cursor/prev_cursor.
+    """
+    forward = before is None
+    cursor = decode_cursor(after if forward else before)
+    # walk the index backwards when going back a page
+    reverse = descending if forward else not descending
+
+    if cursor is not None:
+        value, id = cursor
+        if reverse:
+            query = query.filter(or_(sort_column < value,
+                                     and_(sort_column == value, id_column < id)))
+        else:
+            query = query.filter(or_(sort_column > value,
+                                     and_(sort_column == value, id_column > id)))
+
+    if reverse:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+
+    items = query.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+    if not forward:
+        items.reverse()
+
+    def cursor_of(item):
+        return encode_cursor(getattr(item, sort_column.key), getattr(item, id_column.key))
+
+    next_cursor = prev_cursor = None
+    if items:
+        if more or not forward:
+            next_cursor = cursor_of(items[-1])
+        if (forward and cursor is not None) or (not forward and more):
+            prev_cursor = cursor_of(items[0])
+    return KeysetPage(items, next_cursor, prev_cursor)
+
+
+def prefix_pattern(text):
+    """
+    LIKE pattern matching values that start with text, wildcards escaped
+    """
+    for char in ('\\', '%', '_'):
+        text = text.replace(char, '\\' + char)
+    return text + '%'
@@ -0,0 +1,134 @@
+# app/passwords.py
+
+import os
+import threading
+from functools import partial
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .metrics import timer
+
+try:
+    from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+except ImportError:
+    DEFAULT_PBKDF2_ITERATIONS = 150000
+
+DEFAULT_METHOD = 'pbkdf2:sha256'
+DEFAULT_SALT_LENGTH = 8
+DEFAULT_WORKERS = 4
+# hashes allowed to wait for a worker before logins are turned away
+DEFAULT_QUEUE = 64
+
+
+class HashingBusy(RuntimeError):
+    """
+    Raised when too many password hashes are already waiting for a worker
+    """
+
+
+def hash_method():
+    """
+    The configured method, with the pbkdf2 iteration count spelled out
+    """
+    method = current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        method = '{}:{}'.format(method, DEFAULT_PBKDF2_ITERATIONS)
+    return method
+
+
+def salt_length():
+    return current_app.config.get('PASSWORD_SALT_LENGTH', DEFAULT_SALT_LENGTH)
+
+
+def hasher():
+    """
+    generate_password_hash bound to the configured method and salt length
+
+    A partial of a module level function, so it can be shipped to the
+    process pool of teams.import_teams.
+    """
+    return partial(generate_password_hash, method=hash_method(),
+                   salt_length=salt_length())
+
+
+def needs_rehash(password_hash):
+    """
+    True when password_hash was made with another method, cost or salt length
+    """
+    if not password_hash or password_hash.count('$') < 2:
+        return True
+    method, salt, _ = password_hash.split('$', 2)
+    return method != hash_method() or len(salt) != salt_length()
+
+
+class HashPool(object):
+    """
+    Bounded thread pool the request threads hand password hashing to
+
+    At most PASSWORD_HASH_WORKERS hashes run at once, however many teams log
+    in together, so a login storm cannot take every core away from the
+    dashboard. Up to PASSWORD_HASH_QUEUE more may wait; past that, or when a
+    hash takes over PASSWORD_HASH_TIMEOUT seconds, run raises HashingBusy
+    instead of piling up blocked requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._slots = None
+
+    def _ensure(self):
+        # a pool inherited through fork has no worker threads, make a new one
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    config = current_app.config
+                    workers = config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+                    queue = config.get('PASSWORD_HASH_QUEUE', DEFAULT_QUEUE)
+                    self._slots = threading.BoundedSemaphore(workers + queue)
+                    self._pool = ThreadPool(workers)
+                    self._pid = os.getpid()
+        return self._pool
+
+    def run(self, func, *args):
+        pool = self._ensure()
+        slots = self._slots
+        if not slots.acquire(False):
+            raise HashingBusy('too many password hashes waiting')
+        try:
+            timeout = current_app.config.get('PASSWORD_HASH_TIMEOUT', 30)
+            with timer('hash'):
+                return pool.apply_async(func, args).get(timeout)
+        except TimeoutError:
+            # the hash keeps its worker until done, but the request stops waiting
+            raise HashingBusy('password hash took over {}s'.format(timeout))
+        finally:
+            slots.release()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+            self._pool = None
+
+
+pool = HashPool()
+
+
+def generate(password):
+    """
+    Hash a password with the configured method, on the hashing pool
+    """
+    return pool.run(hasher(), password)
+
+
+def verify(password_hash, password):
+    """
+    Check a password against its hash, on the hashing pool
+    """
+    return pool.run(check_password_hash, password_hash, password)
@@ -0,0 +1,134 @@
+# app/rates.py
+
+import threading
+import time
+from array import array
+
+from flask import current_app
+
+from . import changes, db, exchange
+from .ledger import BARRELS
+from .models import CURRENCIES, GameRound, RoundRate
+
+# every rate that is kept per round; MFD itself is always 1
+SERIES = tuple(c for c in CURRENCIES if c != exchange.BASE_CURRENCY) + (BARRELS,)
+MISSING = float('nan')
+
+
+def record_round(number):
+    """
+    Store the rates in effect during round number, in the caller's transaction
+
+    Called by the settlement before scheduled rates take over, so the row
+    holds what participants actually traded at during that round.
+    """
+    rates = exchange.get_rates()
+    db.session.add(RoundRate(round=number, **dict((c, rates.get(c)) for c in SERIES)))
+
+
+def _value(rate):
+    # NaN marks a currency that had no rate yet
+    return None if rate != rate else rate
+
+
+class RateHistory(object):
+    """
+    Per-round rates held in one array('d') per currency
+
+    Slot r - 1 of every array holds round r, so "rate at round r" is an
+    index lookup, and a chart of the whole game is the arrays as they are.
+    Settled rounds never change, so loading only ever appends the rounds
+    recorded since the last load, with one range read on the primary key.
+    The current round and its live rates are kept for RATES_CACHE_TTL
+    seconds, or until a rate change in this process drops them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = dict((c, array('d')) for c in SERIES)
+        self._loaded_at = None
+        self._current = None
+        self._current_at = None
+
+    def _ttl(self):
+        return current_app.config.get('RATES_CACHE_TTL', 5)
+
+    def __len__(self):
+        """
+        Number of settled rounds held
+        """
+        return len(self._series[SERIES[0]])
+
+    def refresh(self, force=False):
+        if not force and self._loaded_at is not None and \
+                time.time() - self._loaded_at < self._ttl():
+            return
+        rows = db.session.query(
+            RoundRate.round, *[getattr(RoundRate, c) for c in SERIES]
+        ).filter(RoundRate.round > len(self)).order_by(RoundRate.round).all()
+        with self._lock:
+            for row in rows:
+                # rounds settled out of order leave a gap until reloaded
+                if row[0] != len(self) + 1:
+                    break
+                for currency, rate in zip(SERIES, row[1:]):
+                    self._series[currency].append(MISSING if rate is None else rate)
+            self._loaded_at = time.time()
+
+    def current(self, force=False):
+        """
+        Return (current round number or None, live rates)
+        """
+        entry = self._current
+        if force or entry is None or time.time() - self._current_at >= self._ttl():
+            number = db.session.query(GameRound.number).order_by(
+                GameRound.number.desc()).limit(1).scalar()
+            live = exchange.get_rates()
+            rates = dict((c, live.get(c)) for c in SERIES)
+            rates[exchange.BASE_CURRENCY] = 1.0
+            entry = self._current = (number, rates)
+            self._current_at = time.time()
+        return entry
+
+    def is_settled(self, number):
+        if number > len(self):
+            self.refresh()
+        return 1 <= number <= len(self)
+
+    def at(self, number):
+        """
+        Return {currency: rate} for round number, or None if unknown
+        """
+        if self.is_settled(number):
+            rates = dict((c, _value(self._series[c][number - 1])) for c in SERIES)
+            rates[exchange.BASE_CURRENCY] = 1.0
+            return rates
+        current, rates = self.current()
+        if current is None or number == current + 1:
+            # a round may have started since the cached lookup
+            current, rates = self.current(force=True)
+        if current is not None and number == current:
+            return rates
+
+    def series(self):
+        """
+        Return {currency: [rate of round 1, round 2, ...]} of settled rounds
+        """
+        self.refresh()
+        with self._lock:
+            return dict((c, [_value(v) for v in values])
+                        for c, values in self._series.items())
+
+    def rates_changed(self):
+        self._current = None
+        self._loaded_at = None
+
+    def clear(self):
+        with self._lock:
+            self._series = dict((c, array('d')) for c in SERIES)
+            self._loaded_at = None
+            self._current = None
+
+
+history = RateHistory()
+changes.feed.subscribe_rates(history.rates_changed)
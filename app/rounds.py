@@ -0,0 +1,201 @@
+# app/rounds.py
+
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from . import changes, db, ledger
+from .balances import apply_totals
+from .models import CURRENCIES, ExchangeRate, GameRound, Participant, Storage
+from .rates import record_round
+
+# matches the 120 second countdown the dashboard always had
+DEFAULT_ROUND_SECONDS = 120
+
+
+class RoundError(ValueError):
+    """
+    Raised when a round cannot be started
+    """
+
+
+def round_seconds():
+    return current_app.config.get('ROUND_SECONDS', DEFAULT_ROUND_SECONDS)
+
+
+def current():
+    """
+    Return the latest round, or None before the game started
+    """
+    return GameRound.query.order_by(GameRound.number.desc()).first()
+
+
+def clock(now=None):
+    """
+    The authoritative round clock, as served to the dashboards
+
+    remaining is computed here, so a participant's own clock being off does
+    not matter; the page only counts it down.
+    """
+    now = now or datetime.utcnow()
+    game_round = current()
+    if game_round is None:
+        return {'status': 'waiting', 'round': None, 'remaining': None}
+    remaining = max(0.0, (game_round.ends_at - now).total_seconds())
+    if remaining:
+        status = 'running'
+    elif game_round.settled_at is None:
+        status = 'settling'
+    else:
+        status = 'ended'
+    return {'status': status, 'round': game_round.number,
+            'started_at': game_round.started_at.isoformat() + 'Z',
+            'ends_at': game_round.ends_at.isoformat() + 'Z',
+            'remaining': remaining, 'length': round_seconds()}
+
+
+def start(seconds=None, now=None):
+    """
+    Start the next round; the previous one must be over and settled
+    """
+    now = now or datetime.utcnow()
+    seconds = seconds or round_seconds()
+    previous = current()
+    if previous is not None and previous.settled_at is None:
+        raise RoundError('round {} is not settled yet'.format(previous.number))
+    number = previous.number + 1 if previous is not None else 1
+    game_round = GameRound(number=number, started_at=now,
+                           ends_at=now + timedelta(seconds=seconds))
+    db.session.add(game_round)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise RoundError('round {} was started elsewhere'.format(number))
+    return game_round
+
+
+def _interest_and_costs():
+    """
+    Return ({pid: interest deltas}, {pid: storage cost deltas})
+
+    ROUND_INTEREST maps currencies to the fraction paid on positive
+    balances; ROUND_STORAGE_COST is the MFD charged per storage unit owned.
+    Everything is read in one query joining each participant to its storage.
+    """
+    config = current_app.config
+    interest = dict((c, r) for c, r in (config.get('ROUND_INTEREST') or {}).items()
+                    if c in CURRENCIES and r)
+    cost = config.get('ROUND_STORAGE_COST', 0)
+    currencies = sorted(interest)
+    if not currencies and not cost:
+        return {}, {}
+
+    rows = db.session.query(
+        Participant.id, func.coalesce(Storage.stornum, 0),
+        *[getattr(Participant, c) for c in currencies]
+    ).outerjoin(Storage, Storage.storown == Participant.partname)
+
+    earned, charged = {}, {}
+    for row in rows:
+        pid, units = row[0], row[1]
+        deltas = dict((c, float(b) * interest[c]) for c, b in zip(currencies, row[2:])
+                      if b and b > 0)
+        if deltas:
+            earned[pid] = deltas
+        if cost and units:
+            charged[pid] = {'fcd': -float(cost) * units}
+    return earned, charged
+
+
+def settle(number, now=None):
+    """
+    Settle a finished round: rate history, scheduled rates, interest and
+    storage costs
+
+    The round is claimed with a conditional UPDATE on settled_at in the same
+    transaction as the settlement, so however many schedulers run, each
+    round is settled exactly once, and a failed settlement leaves it
+    unclaimed for the next attempt. Returns a summary, or None if the round
+    is not due or was already settled.
+    """
+    now = now or datetime.utcnow()
+    started = time.time()
+    claimed = GameRound.query.filter(
+        GameRound.number == number,
+        GameRound.settled_at.is_(None),
+        GameRound.ends_at <= now
+    ).update({GameRound.settled_at: now}, synchronize_session=False)
+    if claimed != 1:
+        db.session.rollback()
+        return None
+
+    try:
+        record_round(number)
+        rates = ExchangeRate.query.filter(ExchangeRate.next_rate.isnot(None)).update(
+            {ExchangeRate.rate: ExchangeRate.next_rate, ExchangeRate.next_rate: None},
+            synchronize_session=False)
+        earned, charged = _interest_and_costs()
+        if earned:
+            apply_totals(earned, reason='interest')
+        if charged:
+            apply_totals(charged, reason='storage_cost')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if rates:
+        changes.feed.notify_rates()
+    touched = set(earned) | set(charged)
+    if touched:
+        changes.feed.notify(participants=touched)
+    # a round boundary is a quiet moment to fold the ledger tails
+    snapshots = ledger.compact()
+    return {'round': number, 'rates': rates, 'interest': len(earned),
+            'storage_costs': len(charged), 'snapshots': snapshots,
+            'elapsed': time.time() - started}
+
+
+def run(rounds=None, pause=0, poll=1.0, log=None, stop=None):
+    """
+    Drive the game: settle each round as it ends, then start the next one
+
+    Meant for a worker process of its own (``flask admin run-rounds``), so
+    settlement never runs on a request thread. Stops after the given number
+    of rounds, or when the stop Event is set. pause is the break in seconds
+    between settling one round and starting the next.
+    """
+    log = log or (lambda message: None)
+    while stop is None or not stop.is_set():
+        db.session.expire_all()
+        game_round = current()
+        now = datetime.utcnow()
+        if game_round is None or game_round.settled_at is not None:
+            if rounds is not None and game_round is not None and game_round.number >= rounds:
+                break
+            try:
+                game_round = start()
+                log('round {} started, ends {}'.format(game_round.number, game_round.ends_at))
+            except RoundError as e:
+                log(str(e))
+        elif game_round.ends_at <= now:
+            report = settle(game_round.number)
+            if report is not None:
+                log('round {round} settled in {elapsed:.3f}s: {rates} rates, '
+                    '{interest} paid interest, {storage_costs} charged for storage'.format(**report))
+                if pause:
+                    time.sleep(pause)
+                continue
+        wait = poll
+        if game_round is not None and game_round.settled_at is None:
+            remaining = (game_round.ends_at - datetime.utcnow()).total_seconds()
+            if remaining > 0:
+                wait = min(poll, remaining)
+        if stop is not None:
+            stop.wait(wait)
+        else:
+            time.sleep(wait)
@@ -0,0 +1,73 @@
+# app/routing.py
+
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session as cookie_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import event, orm
+
+REPLICA = 'replica'
+
+
+def use_replica():
+    """
+    True when the current request is a read-only view and a replica is set up
+
+    Clients that wrote something in the last REPLICA_STICKY_SECONDS stay on
+    the primary, so an admin is never redirected to a list that does not
+    show their own edit yet.
+    """
+    if not has_request_context() or not getattr(g, '_read_only', False):
+        return False
+    if REPLICA not in (current_app.config.get('SQLALCHEMY_BINDS') or {}):
+        return False
+    return cookie_session.get('_primary_until', 0) < time.time()
+
+
+def read_only(view):
+    """
+    Mark a view as read-only so its queries may be sent to the replica
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that reads from the replica inside read-only views
+
+    Flushes, and everything outside read-only views, go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and use_replica():
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        SQLAlchemy.init_app(self, app)
+        app.after_request(_pin_writers_to_primary)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_write(session):
+    if has_request_context():
+        g._wrote = True
+
+
+def _pin_writers_to_primary(response):
+    if getattr(g, '_wrote', False) and \
+            REPLICA in (current_app.config.get('SQLALCHEMY_BINDS') or {}):
+        sticky = current_app.config.get('REPLICA_STICKY_SECONDS', 5)
+        cookie_session['_primary_until'] = time.time() + sticky
+    return response
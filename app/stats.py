@@ -0,0 +1,166 @@
+# app/stats.py
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import case, func, or_
+
+from . import db, ledger, rounds
+from .barrels import capacity_per_storage
+from .models import CURRENCIES, CURRENCY_PLACES, LedgerEntry, Participant, Storage
+from .money import to_decimal
+from .rates import history
+
+# storage fill histogram: 0-10%, 10-20%, ... 90-100%
+BUCKETS = 10
+# ledger reasons that open or close accounts rather than move money
+IGNORED_REASONS = ('open', 'close')
+DEFAULT_MOVERS = 5
+
+
+def utilization_bucket(capacity):
+    """
+    SQL for the fill bucket (0 to BUCKETS - 1) of a storage, NULL if it has no room
+
+    Integer comparisons only, so every database puts a storage in the same
+    bucket.
+    """
+    fill = Storage.current_capacity * BUCKETS
+    room = Storage.stornum * capacity
+    whens = [(Storage.stornum <= 0, None)]
+    whens += [(fill >= room * b, b) for b in range(BUCKETS - 1, 0, -1)]
+    return case(whens, else_=0)
+
+
+class DashboardStats(object):
+    """
+    Totals, counts, storage fill and this round's movers for the admin dashboard
+
+    Built from a handful of aggregate queries: one pass over participants
+    and one over storages, and this round's ledger entries through the
+    created_at index. Every committed ledger entry in this process is then
+    added to the totals and the round's movements as it happens, so loading
+    the dashboard costs no query. A new round, or an age over STATS_MAX_AGE
+    seconds (which picks up other processes and the counts), rebuilds it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._counts = {}
+        self._histogram = []
+        self._round = None
+        self._flows = {}
+        self._built_at = None
+
+    def _stale(self, round_number):
+        if self._built_at is None or round_number != self._round:
+            return True
+        max_age = current_app.config.get('STATS_MAX_AGE', 30)
+        return time.time() - self._built_at > max_age
+
+    def rebuild(self):
+        row = db.session.query(
+            func.count(Participant.id),
+            *[func.sum(getattr(Participant, c)) for c in CURRENCIES]).one()
+        totals = dict((c, to_decimal(t or 0, CURRENCY_PLACES[c]))
+                      for c, t in zip(CURRENCIES, row[1:]))
+        storages, barrels = db.session.query(
+            func.count(Storage.id), func.sum(Storage.current_capacity)).one()
+        totals[ledger.BARRELS] = int(barrels or 0)
+
+        histogram = [0] * BUCKETS
+        bucket = utilization_bucket(capacity_per_storage()).label('bucket')
+        for number, count in db.session.query(bucket, func.count()).group_by(bucket):
+            if number is not None:
+                histogram[int(number)] = count
+
+        game_round = rounds.current()
+        flows = {}
+        if game_round is not None:
+            moved = db.session.query(
+                LedgerEntry.participant_id, LedgerEntry.asset, func.sum(LedgerEntry.delta)
+            ).filter(
+                LedgerEntry.created_at >= game_round.started_at,
+                LedgerEntry.participant_id.isnot(None),
+                or_(LedgerEntry.reason.is_(None), ~LedgerEntry.reason.in_(IGNORED_REASONS))
+            ).group_by(LedgerEntry.participant_id, LedgerEntry.asset)
+            for pid, asset, delta in moved:
+                flows.setdefault(pid, {})[asset] = delta or 0
+
+        with self._lock:
+            self._totals = totals
+            self._counts = {'participants': row[0], 'storages': storages}
+            self._histogram = histogram
+            self._round = game_round.number if game_round is not None else None
+            self._flows = flows
+            self._built_at = time.time()
+
+    def committed(self, entries):
+        """
+        Ledger subscriber: add committed deltas to the totals and movements
+        """
+        if self._built_at is None:
+            return
+        with self._lock:
+            for entry in entries:
+                asset, delta = entry['asset'], entry['delta']
+                if asset == ledger.BARRELS:
+                    self._totals[asset] = self._totals.get(asset, 0) + int(delta)
+                elif asset in self._totals:
+                    self._totals[asset] += to_decimal(delta, CURRENCY_PLACES[asset])
+                pid = entry.get('participant_id')
+                if pid is not None and self._round is not None and \
+                        entry.get('reason') not in IGNORED_REASONS:
+                    flows = self._flows.setdefault(pid, {})
+                    flows[asset] = flows.get(asset, 0) + delta
+
+    def snapshot(self, movers=DEFAULT_MOVERS):
+        """
+        Return the dashboard figures, with movers valued at the live rates
+        """
+        round_number, rates = history.current()
+        if self._stale(round_number):
+            self.rebuild()
+        with self._lock:
+            totals = dict(self._totals)
+            counts = dict(self._counts)
+            histogram = list(self._histogram)
+            flows = dict((pid, dict(f)) for pid, f in self._flows.items())
+
+        moved = sorted((sum(float(d) * (rates.get(a) or 0) for a, d in f.items()), pid)
+                       for pid, f in flows.items())
+        gainers = [m for m in reversed(moved[-movers:]) if m[0] > 0]
+        losers = [m for m in moved[:movers] if m[0] < 0]
+        names = {}
+        if gainers or losers:
+            names = dict(db.session.query(Participant.id, Participant.partname).filter(
+                Participant.id.in_([pid for _, pid in gainers + losers])))
+
+        def described(entries):
+            return [dict(id=pid, partname=names.get(pid), change=change)
+                    for change, pid in entries]
+
+        step = 100 // BUCKETS
+        return {
+            'round': self._round,
+            'totals': dict((k, float(v)) for k, v in totals.items()),
+            'participants': counts.get('participants', 0),
+            'storages': counts.get('storages', 0),
+            'active': len(flows),
+            'utilization': [dict(bucket='{}-{}%'.format(i * step, (i + 1) * step), storages=n)
+                            for i, n in enumerate(histogram)],
+            'gainers': described(gainers),
+            'losers': described(losers),
+            'built_at': self._built_at,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._built_at = None
+            self._flows = {}
+
+
+stats = DashboardStats()
+ledger.subscribe(stats.committed)
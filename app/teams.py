@@ -0,0 +1,113 @@
+# app/teams.py
+
+import time
+from multiprocessing import Pool
+
+from . import db, ledger, passwords
+from .models import CURRENCIES, Participant, Storage, User
+
+# what every team starts the game with
+STARTING_BALANCES = {'fcd': 100000.0, 'usd': 0.0, 'sar': 0.0, 'rub': 0.0, 'yen': 0.0}
+STARTING_STORAGES = 1
+
+
+def create_team(username, password):
+    """
+    Create a user with its participant and storage in one transaction
+
+    The user row is linked to both through userid/storid, and nothing is
+    left behind if any of the inserts fails.
+    """
+    participant = Participant(partname=username, **STARTING_BALANCES)
+    storage = Storage(storown=username, stornum=STARTING_STORAGES,
+                      current_capacity=0)
+    try:
+        db.session.add(participant)
+        db.session.add(storage)
+        db.session.flush()
+        user = User(username=username, password=password,
+                    userid=participant.id, storid=storage.id)
+        db.session.add(user)
+        ledger.record_participant(participant, reason='open')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return user
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def import_teams(rows, batch_size=500, workers=None):
+    """
+    Pre-create many teams from (username, password) pairs
+
+    Password hashes are computed on a process pool, then each batch is
+    written with three executemany INSERTs (participants, storages, users)
+    and committed on its own. Usernames that already exist in any of the
+    three tables are skipped. Returns a summary dict.
+    """
+    started = time.time()
+    seen = set()
+    teams = []
+    for username, password in rows:
+        username = (username or '').strip()
+        if username and password and username not in seen:
+            seen.add(username)
+            teams.append((username, password))
+
+    existing = set()
+    for chunk in _chunks([u for u, _ in teams], batch_size):
+        for column in (User.username, Participant.partname, Storage.storown):
+            existing.update(name for name, in db.session.query(column).filter(
+                column.in_(chunk)))
+    teams = [(u, p) for u, p in teams if u not in existing]
+
+    pool = Pool(workers)
+    try:
+        hashes = pool.map(passwords.hasher(), [p for _, p in teams],
+                          chunksize=max(1, batch_size // 4))
+    finally:
+        pool.close()
+        pool.join()
+    hashed = time.time()
+
+    created = 0
+    for batch in _chunks(list(zip([u for u, _ in teams], hashes)), batch_size):
+        names = [u for u, _ in batch]
+        try:
+            db.session.execute(Participant.__table__.insert(), [
+                dict(STARTING_BALANCES, partname=name) for name in names])
+            db.session.execute(Storage.__table__.insert(), [
+                dict(storown=name, stornum=STARTING_STORAGES, current_capacity=0)
+                for name in names])
+            participant_ids = dict(db.session.query(
+                Participant.partname, Participant.id).filter(
+                Participant.partname.in_(names)))
+            storage_ids = dict(db.session.query(
+                Storage.storown, Storage.id).filter(Storage.storown.in_(names)))
+            db.session.execute(User.__table__.insert(), [
+                dict(username=name, password_hash=password_hash, is_admin=False,
+                     userid=participant_ids[name], storid=storage_ids[name])
+                for name, password_hash in batch])
+            ledger.record_many(
+                (dict(participant_id=participant_ids[name], asset=c,
+                      delta=STARTING_BALANCES[c])
+                 for name in names for c in CURRENCIES),
+                reason='open')
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        created += len(batch)
+
+    finished = time.time()
+    return {
+        'created': created,
+        'skipped': len(existing),
+        'hash_seconds': hashed - started,
+        'elapsed': finished - started,
+    }
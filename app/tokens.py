@@ -0,0 +1,238 @@
+# app/tokens.py
+
+import base64
+import calendar
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, has_request_context, session
+from flask_login import UserMixin
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from . import db, login_manager
+from .models import Participant, Revocation, Storage, load_user as load_from_database
+
+# session key holding the signed claim
+CLAIM_KEY = '_claim'
+DEFAULT_TTL = 300
+# seconds between looks at the revocations table, per process
+DEFAULT_POLL = 1.0
+
+
+def enabled():
+    return current_app.config.get('AUTH_TOKENS', False)
+
+
+def ttl():
+    return current_app.config.get('AUTH_TOKEN_TTL', DEFAULT_TTL)
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='auth-claim')
+
+
+def _user_key(user_id):
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return user_id
+
+
+def _timestamp(moment):
+    return calendar.timegm(moment.utctimetuple())
+
+
+class TokenUser(UserMixin):
+    """
+    The logged in user as vouched for by a verified claim
+
+    Has the attributes the views use from a User. The participant and
+    storage rows are only loaded when asked for.
+    """
+
+    def __init__(self, id, username, is_admin, userid, storid, jti, issued_at):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
+        self.userid = userid
+        self.storid = storid
+        self.jti = jti
+        self.issued_at = issued_at
+
+    @property
+    def participant(self):
+        return Participant.query.get(self.userid) if self.userid is not None else None
+
+    @property
+    def storage(self):
+        return Storage.query.get(self.storid) if self.storid is not None else None
+
+    def __repr__(self):
+        return '<TokenUser: {}>'.format(self.username)
+
+
+class RevocationList(object):
+    """
+    Revoked claims, mirrored from the revocations table
+
+    Checking a claim is a dict lookup. Each process reads only the rows
+    added since its last look, at most every AUTH_REVOCATION_POLL seconds,
+    and forgets entries once the claims they cover have expired. Revoking
+    takes effect at once in the process that revokes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jtis = {}
+        self._users = {}
+        self._last_id = 0
+        self._checked_at = None
+
+    def _add(self, key, revoked_at, expires_at):
+        kind, _, value = key.partition(':')
+        if kind == 'jti':
+            self._jtis[value] = expires_at
+        elif kind == 'user':
+            user_id = int(value)
+            previous = self._users.get(user_id)
+            if previous is None or previous[0] < revoked_at:
+                self._users[user_id] = (revoked_at, expires_at)
+
+    def refresh(self, force=False):
+        poll = current_app.config.get('AUTH_REVOCATION_POLL', DEFAULT_POLL)
+        now = time.time()
+        if not force and self._checked_at is not None and now - self._checked_at < poll:
+            return
+        rows = db.session.query(
+            Revocation.id, Revocation.key, Revocation.revoked_at, Revocation.expires_at
+        ).filter(Revocation.id > self._last_id,
+                 Revocation.expires_at > datetime.utcnow()).order_by(Revocation.id).all()
+        with self._lock:
+            for row_id, key, revoked_at, expires_at in rows:
+                self._add(key, _timestamp(revoked_at), _timestamp(expires_at))
+                self._last_id = max(self._last_id, row_id)
+            self._jtis = dict((k, v) for k, v in self._jtis.items() if v > now)
+            self._users = dict((k, v) for k, v in self._users.items() if v[1] > now)
+            self._checked_at = now
+
+    def is_revoked(self, jti, user_id, issued_at):
+        self.refresh()
+        if jti in self._jtis:
+            return True
+        revoked = self._users.get(user_id)
+        return revoked is not None and issued_at <= revoked[0]
+
+    def user_revoked(self, user_id):
+        """
+        Whether the user's claims were revoked within the last claim lifetime
+        """
+        self.refresh()
+        return user_id in self._users
+
+    def revoke(self, key):
+        """
+        Store a revocation and apply it here; the caller commits
+        """
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=ttl())
+        # rows whose claims have all expired are not needed any more
+        Revocation.query.filter(Revocation.expires_at <= now).delete(
+            synchronize_session=False)
+        db.session.add(Revocation(key=key, revoked_at=now, expires_at=expires_at))
+        with self._lock:
+            self._add(key, time.time(), _timestamp(expires_at))
+
+    def clear(self):
+        with self._lock:
+            self._jtis, self._users = {}, {}
+            self._last_id, self._checked_at = 0, None
+
+
+revocations = RevocationList()
+
+
+def issue(user):
+    """
+    Put a fresh claim for user into the session, when AUTH_TOKENS is on
+    """
+    if not enabled():
+        return
+    jti = base64.urlsafe_b64encode(os.urandom(6)).decode('ascii')
+    session[CLAIM_KEY] = _serializer().dumps(
+        [user.id, user.username, int(bool(user.is_admin)), user.userid, user.storid, jti])
+
+
+def verify(token, user_id=None):
+    """
+    Return the TokenUser of a claim, or None if it is forged, expired,
+    revoked, or not about user_id
+    """
+    try:
+        claim, issued_at = _serializer().loads(token, max_age=ttl(),
+                                               return_timestamp=True)
+        uid, username, is_admin, userid, storid, jti = claim
+    except (BadSignature, TypeError, ValueError):
+        return None
+    if user_id is not None and str(uid) != str(user_id):
+        return None
+    issued_at = _timestamp(issued_at)
+    if revocations.is_revoked(jti, uid, issued_at):
+        return None
+    return TokenUser(uid, username, bool(is_admin), userid, storid, jti, issued_at)
+
+
+def _sign_out():
+    # Flask-Login 0.4 keeps the id under user_id, later versions under _user_id
+    for key in ('user_id', '_user_id', '_fresh', CLAIM_KEY):
+        session.pop(key, None)
+
+
+def load_user(user_id):
+    """
+    Flask-Login user loader: the session's claim, else the database
+
+    While a claim is valid no query is made. Once it is past half its
+    lifetime, the user is read again, which picks up bans and changed
+    rows, and a new claim is issued. A forged, expired or revoked claim
+    signs the session out; so does a session without a claim whose user
+    was revoked.
+    """
+    if enabled() and has_request_context():
+        token = session.get(CLAIM_KEY)
+        user = verify(token, user_id) if token else None
+        if user is None and (token or revocations.user_revoked(_user_key(user_id))):
+            _sign_out()
+            return None
+        if user is not None and time.time() - user.issued_at < ttl() / 2.0:
+            return user
+        user = load_from_database(user_id)
+        if user is None:
+            session.pop(CLAIM_KEY, None)
+        else:
+            issue(user)
+        return user
+    return load_from_database(user_id)
+
+
+def revoke_session():
+    """
+    Revoke the claim of the current session, e.g. on logout
+    """
+    token = session.pop(CLAIM_KEY, None)
+    user = verify(token) if token else None
+    if user is not None:
+        revocations.revoke('jti:' + user.jti)
+        db.session.commit()
+
+
+def revoke_user(user_id):
+    """
+    Revoke every claim issued to a user so far; the caller commits
+    """
+    revocations.revoke('user:{}'.format(user_id))
+
+
+def init_app(app):
+    login_manager.user_loader(load_user)
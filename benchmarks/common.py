@@ -0,0 +1,81 @@
+# benchmarks/common.py
+
+import os
+import tempfile
+import threading
+import time
+
+from app import create_app, db
+from app.models import Participant, Storage
+
+# rupiah per unit, roughly what the game starts with
+RATES = {'usd': 14000.0, 'sar': 3700.0, 'rub': 210.0, 'yen': 125.0}
+
+
+def default_database_uri(name):
+    """
+    A throwaway SQLite file, so benchmarks need no database server
+    """
+    return 'sqlite:///' + os.path.join(tempfile.gettempdir(), name + '.db')
+
+
+def make_app(database_uri):
+    """
+    Build the app in testing mode against the given database
+    """
+    app = create_app('testing')
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SQLALCHEMY_ECHO=False,
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SECRET_KEY=app.config.get('SECRET_KEY') or 'benchmark',
+        WTF_CSRF_ENABLED=False
+    )
+    return app
+
+
+def seed(participants, fcd=100000.0):
+    """
+    Recreate the schema with N participants and their storages
+    """
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Participant.__table__.insert(), [
+        dict(partname='team{}'.format(i), fcd=fcd, usd=0.0, sar=0.0,
+             rub=0.0, yen=0.0) for i in range(participants)])
+    db.session.execute(Storage.__table__.insert(), [
+        dict(storown='team{}'.format(i), stornum=1, current_capacity=0)
+        for i in range(participants)])
+    db.session.commit()
+
+
+def percentile(values, fraction):
+    """
+    The value below which the given fraction of values fall
+    """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_workers(app, workers, target):
+    """
+    Run target(worker_index) on N threads inside app contexts
+
+    Returns the wall-clock time it took for all of them to finish.
+    """
+    def run(index):
+        with app.app_context():
+            try:
+                target(index)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(workers)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - started
@@ -0,0 +1,84 @@
+# benchmarks/exchange.py
+
+"""
+Concurrent currency exchange benchmark
+
+    python -m benchmarks.exchange --workers 16 --trades 200 --teams 20
+
+Every worker trades random currency pairs for a small set of hot teams, so
+many trades hit the same rows at once. Reports trades per second and checks
+that no value was created or lost along the way.
+"""
+
+import argparse
+import random
+import threading
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.balances import CURRENCIES
+from app.exchange import ExchangeError, InsufficientFunds, exchange, get_rates, set_rate
+from app.models import Participant
+
+from .common import RATES, default_database_uri, make_app, run_workers, seed
+
+
+def total_value(rates):
+    columns = [func.sum(getattr(Participant, c)) for c in CURRENCIES]
+    totals = db.session.query(*columns).one()
+    return sum(float(t or 0) * rates[c] for c, t in zip(CURRENCIES, totals))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-uri', default=default_database_uri('bench_exchange'))
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--trades', type=int, default=200, help='trades per worker')
+    parser.add_argument('--teams', type=int, default=20, help='number of teams trading')
+    args = parser.parse_args()
+
+    app = make_app(args.database_uri)
+    counts = {'ok': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    with app.app_context():
+        seed(args.teams)
+        for currency, rate in RATES.items():
+            set_rate(currency, rate)
+        rates = get_rates()
+        ids = [pid for pid, in db.session.query(Participant.id)]
+        before = total_value(rates)
+
+    def trade(index):
+        rng = random.Random(index)
+        for _ in range(args.trades):
+            source, target = rng.sample(CURRENCIES, 2)
+            amount = rng.uniform(1, 5000) / rates[source]
+            try:
+                exchange(rng.choice(ids), source, target, amount)
+                outcome = 'ok'
+            except InsufficientFunds:
+                outcome = 'rejected'
+            except (ExchangeError, OperationalError):
+                db.session.rollback()
+                outcome = 'errors'
+            with lock:
+                counts[outcome] += 1
+
+    elapsed = run_workers(app, args.workers, trade)
+
+    with app.app_context():
+        after = total_value(rates)
+
+    attempted = sum(counts.values())
+    print('{} trades on {} teams with {} workers in {:.2f}s'.format(
+        attempted, args.teams, args.workers, elapsed))
+    print('  {:.0f} trades/s, {ok} filled, {rejected} rejected, {errors} errors'.format(
+        attempted / elapsed, **counts))
+    print('  total value drift: {:.6f} MFD'.format(after - before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# benchmarks/load.py
+
+"""
+End-to-end load benchmark with per-endpoint latency and saved baselines
+
+    python -m benchmarks.load --teams 50 --admins 2 --duration 30
+    python -m benchmarks.load --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load --compare benchmarks/baseline.json
+
+Seeds N teams (user, participant and storage each) plus admin accounts,
+then simulates them concurrently through the app: every team logs in and
+polls its dashboard and /api/me, trading now and then, while the admins
+page through the lists, edit participants, pay out and move barrels.
+Reports requests/sec and p50/p95/p99 latency per endpoint, plus server
+errors and rejected requests: 4xx answers other than the ones a request
+can legitimately get (409 for a trade without the funds, a move past
+capacity or an edit that lost a race to another write), which mean the
+simulation is not doing what it should.
+
+--save-baseline writes those numbers to a JSON file. --compare checks a
+run against one and exits with status 1 when any request was rejected or
+failed, or when an endpoint's p95 grew, or its throughput fell, by more
+than --tolerance.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+from app import db
+from app.exchange import set_rate
+from app.models import Participant, Storage, User
+from app.passwords import pool
+from app.teams import import_teams
+
+from .common import RATES, default_database_uri, make_app, percentile, run_workers, seed
+
+
+class Recorder(object):
+    """
+    Collects request latencies per endpoint across worker threads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.rejected = {}
+
+    def request(self, client, endpoint, method, url, expected=(), **kwargs):
+        """
+        Time one request; 5xx counts as an error, 4xx not in expected as rejected
+        """
+        started = time.time()
+        response = getattr(client, method)(url, **kwargs)
+        elapsed = time.time() - started
+        status = response.status_code
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if status >= 500:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            elif status >= 400 and status not in expected:
+                self.rejected[endpoint] = self.rejected.get(endpoint, 0) + 1
+        return response
+
+    def summary(self, elapsed):
+        report = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            report[endpoint] = {
+                'requests': len(values),
+                'errors': self.errors.get(endpoint, 0),
+                'rejected': self.rejected.get(endpoint, 0),
+                'rps': len(values) / elapsed,
+                'p50': percentile(values, .50) * 1000,
+                'p95': percentile(values, .95) * 1000,
+                'p99': percentile(values, .99) * 1000,
+            }
+        return report
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return a line for each endpoint that regressed against the baseline
+
+    Any failed or rejected request counts, whatever the baseline had.
+    """
+    regressions = []
+    for endpoint, current in sorted(report.items()):
+        for key in ('errors', 'rejected'):
+            if current.get(key):
+                regressions.append('{}: {} {} requests'.format(endpoint, current[key], key))
+    for endpoint, base in sorted(baseline.items()):
+        current = report.get(endpoint)
+        if current is None:
+            regressions.append('{}: not exercised'.format(endpoint))
+            continue
+        if current['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append('{}: p95 {:.1f}ms, baseline {:.1f}ms'.format(
+                endpoint, current['p95'], base['p95']))
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append('{}: {:.1f} req/s, baseline {:.1f} req/s'.format(
+                endpoint, current['rps'], base['rps']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-uri', default=default_database_uri('bench_load'))
+    parser.add_argument('--teams', type=int, default=50)
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--think', type=float, default=0.05,
+                        help='seconds a simulated user waits between requests')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    app = make_app(args.database_uri)
+    # load is about the app, not about password hashing cost
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    teams = ['team{}'.format(i) for i in range(args.teams)]
+    admins = ['admin{}'.format(i) for i in range(args.admins)]
+
+    with app.app_context():
+        seed(0)
+        for currency, rate in RATES.items():
+            set_rate(currency, rate)
+        import_teams([(name, 'pw-' + name) for name in teams])
+        for name in admins:
+            db.session.add(User(username=name, password='pw-' + name, is_admin=True))
+        db.session.commit()
+        partnames = dict(db.session.query(Participant.id, Participant.partname))
+        participant_ids = sorted(partnames)
+        storage_ids = [sid for sid, in db.session.query(Storage.id)]
+
+    recorder = Recorder()
+    deadline = [None]
+
+    def pause(rng):
+        time.sleep(rng.uniform(0, 2 * args.think))
+
+    def team(rng, client, name):
+        etag = None
+        while time.time() < deadline[0]:
+            recorder.request(client, 'GET /dashboard', 'get', '/dashboard')
+            pause(rng)
+            headers = {'If-None-Match': etag} if etag else {}
+            response = recorder.request(client, 'GET /api/me', 'get', '/api/me',
+                                        headers=headers)
+            etag = response.headers.get('ETag') or etag
+            pause(rng)
+            if rng.random() < 0.2:
+                recorder.request(client, 'POST /exchange', 'post', '/exchange', json={
+                    'from': 'fcd', 'to': rng.choice(('usd', 'sar', 'rub', 'yen')),
+                    'amount': rng.randint(1, 100)}, expected=(409,))
+                pause(rng)
+
+    def admin(rng, client, name):
+        while time.time() < deadline[0]:
+            recorder.request(client, 'GET /admin/participants', 'get',
+                             '/admin/participants?sort=fcd&dir=desc')
+            pause(rng)
+            pid = rng.choice(participant_ids)
+            recorder.request(client, 'POST /admin/participants/edit/<id>', 'post',
+                             '/admin/participants/edit/{}'.format(pid), data=dict(
+                                 partname=partnames[pid], fcd='100,000',
+                                 usd='0', sar='0', rub='0', yen='0'), expected=(409,))
+            pause(rng)
+            recorder.request(client, 'POST /admin/participants/adjust', 'post',
+                             '/admin/participants/adjust', json=[
+                                 {'id': p, 'fcd': 10} for p in rng.sample(
+                                     participant_ids, min(10, len(participant_ids)))])
+            pause(rng)
+            recorder.request(client, 'GET /admin/storages', 'get', '/admin/storages')
+            pause(rng)
+            recorder.request(client, 'POST /admin/storages/move/<id>', 'post',
+                             '/admin/storages/move/{}'.format(rng.choice(storage_ids)),
+                             json={'barrels': rng.choice((-1, 1)) * rng.randint(1, 50)},
+                             expected=(409,))
+            pause(rng)
+
+    users = [(team, name) for name in teams] + [(admin, name) for name in admins]
+
+    def work(index):
+        role, name = users[index]
+        rng = random.Random(args.seed * 100003 + index)
+        client = app.test_client()
+        recorder.request(client, 'POST /login', 'post', '/login',
+                         data=dict(username=name, password='pw-' + name))
+        role(rng, client, name)
+
+    deadline[0] = time.time() + args.duration
+    elapsed = run_workers(app, len(users), work)
+    pool.close()
+    report = recorder.summary(elapsed)
+
+    print('{} teams and {} admins for {:.1f}s'.format(args.teams, args.admins, elapsed))
+    print('{:<36} {:>8} {:>7} {:>8} {:>8} {:>8} {:>8} {:>8}'.format(
+        'endpoint', 'requests', 'errors', 'rejected', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for endpoint, stats in sorted(report.items()):
+        print('{:<36} {requests:>8} {errors:>7} {rejected:>8} {rps:>8.1f} {p50:>8.1f} '
+              '{p95:>8.1f} {p99:>8.1f}'.format(endpoint, **stats))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('baseline saved to {}'.format(args.save_baseline))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        if regressions:
+            sys.exit(1)
+        print('no regressions against {}'.format(args.compare))
+
+
+if __name__ == '__main__':
+    main()
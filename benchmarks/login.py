@@ -0,0 +1,92 @@
+# benchmarks/login.py
+
+"""
+Login storm benchmark
+
+    python -m benchmarks.login --workers 32 --teams 200 --method pbkdf2:sha256:150000
+
+Every team logs in at once, as at the start of a round, while one probe
+keeps requesting the home page. Reports logins per second, login and probe
+latency, how many logins were turned away as busy and how many stored
+hashes were upgraded. Seed with --stored-method to measure the rehash path.
+"""
+
+import argparse
+import threading
+import time
+
+from app import db
+from app.models import User
+from app.passwords import needs_rehash, pool
+from app.teams import import_teams
+
+from .common import default_database_uri, make_app, percentile, run_workers, seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-uri', default=default_database_uri('bench_login'))
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--teams', type=int, default=200)
+    parser.add_argument('--method', default='pbkdf2:sha256', help='PASSWORD_HASH_METHOD')
+    parser.add_argument('--stored-method', help='method the seeded hashes use')
+    parser.add_argument('--hash-workers', type=int, default=4, help='PASSWORD_HASH_WORKERS')
+    args = parser.parse_args()
+
+    app = make_app(args.database_uri)
+    app.config.update(PASSWORD_HASH_METHOD=args.stored_method or args.method,
+                      PASSWORD_HASH_WORKERS=args.hash_workers)
+    teams = ['team{}'.format(i) for i in range(args.teams)]
+
+    with app.app_context():
+        seed(0)
+        import_teams([(name, 'pw-' + name) for name in teams])
+    app.config['PASSWORD_HASH_METHOD'] = args.method
+
+    statuses = {}
+    latencies = []
+    probes = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def work(index):
+        client = app.test_client()
+        for name in teams[index::args.workers]:
+            started = time.time()
+            response = client.post('/login', data=dict(username=name, password='pw-' + name))
+            with lock:
+                latencies.append(time.time() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            client.get('/logout')
+
+    def probe():
+        client = app.test_client()
+        while not done.is_set():
+            started = time.time()
+            client.get('/')
+            probes.append(time.time() - started)
+            time.sleep(0.01)
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    try:
+        elapsed = run_workers(app, args.workers, work)
+    finally:
+        done.set()
+        prober.join()
+
+    with app.app_context():
+        outdated = sum(1 for h, in db.session.query(User.password_hash) if needs_rehash(h))
+    pool.close()
+
+    print('{} logins with {} workers and {} hash workers in {:.2f}s'.format(
+        len(latencies), args.workers, args.hash_workers, elapsed))
+    print('  {:.1f} logins/s, {} ok, {} busy, {} outdated hashes left'.format(
+        len(latencies) / elapsed, statuses.get(302, 0), statuses.get(503, 0), outdated))
+    print('  login p50 {:.0f}ms p95 {:.0f}ms, home page p50 {:.0f}ms p95 {:.0f}ms'.format(
+        percentile(latencies, .5) * 1000, percentile(latencies, .95) * 1000,
+        percentile(probes, .5) * 1000, percentile(probes, .95) * 1000))
+
+
+if __name__ == '__main__':
+    main()
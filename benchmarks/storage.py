@@ -0,0 +1,74 @@
+# benchmarks/storage.py
+
+"""
+Barrel storage contention benchmark
+
+    python -m benchmarks.storage --workers 16 --moves 200 --teams 5
+
+Workers deposit and withdraw barrels on a few shared storages at once and
+keep hitting the capacity limit. Reports moves per second and checks that
+no storage ended up overfilled or negative.
+"""
+
+import argparse
+import random
+import threading
+
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.barrels import CapacityExceeded, capacity_per_storage, move
+from app.models import Storage
+
+from .common import default_database_uri, make_app, run_workers, seed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-uri', default=default_database_uri('bench_storage'))
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--moves', type=int, default=200, help='moves per worker')
+    parser.add_argument('--teams', type=int, default=5, help='number of storages')
+    args = parser.parse_args()
+
+    app = make_app(args.database_uri)
+    counts = {'ok': 0, 'rejected': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    with app.app_context():
+        seed(args.teams)
+        ids = [sid for sid, in db.session.query(Storage.id)]
+        capacity = capacity_per_storage()
+
+    def work(index):
+        rng = random.Random(index)
+        for _ in range(args.moves):
+            barrels = rng.randint(1, capacity // 4) * rng.choice((1, 1, -1))
+            try:
+                move(rng.choice(ids), barrels)
+                outcome = 'ok'
+            except CapacityExceeded:
+                outcome = 'rejected'
+            except OperationalError:
+                db.session.rollback()
+                outcome = 'errors'
+            with lock:
+                counts[outcome] += 1
+
+    elapsed = run_workers(app, args.workers, work)
+
+    with app.app_context():
+        bad = Storage.query.filter(
+            (Storage.current_capacity < 0) |
+            (Storage.current_capacity > Storage.stornum * capacity)).count()
+
+    attempted = sum(counts.values())
+    print('{} moves on {} storages with {} workers in {:.2f}s'.format(
+        attempted, args.teams, args.workers, elapsed))
+    print('  {:.0f} moves/s, {ok} applied, {rejected} rejected, {errors} errors'.format(
+        attempted / elapsed, **counts))
+    print('  storages outside capacity: {}'.format(bad))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 # config.py
 
+import os
+
 class Config(object):
     """
     Common configurations
@@ -30,6 +32,29 @@ class TestingConfig(Config):
     """
 
     TESTING = True
+    # cheap hashes keep the test suite fast
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+def engine_options(database_uri, environ=os.environ):
+    """
+    SQLAlchemy engine options, tunable from the environment
+
+    Connections are pinged before use and recycled before MySQL's idle
+    timeout, so the first request after a quiet spell does not fail on a
+    dead connection. Pool sizing is skipped for SQLite, which does not pool.
+    """
+    options = {
+        'pool_pre_ping': environ.get('SQLALCHEMY_POOL_PRE_PING', 'true').lower()
+                         not in ('0', 'false', 'no'),
+        'pool_recycle': int(environ.get('SQLALCHEMY_POOL_RECYCLE', 1800)),
+    }
+    if not (database_uri or '').startswith('sqlite'):
+        for option, name in (('pool_size', 'SQLALCHEMY_POOL_SIZE'),
+                             ('max_overflow', 'SQLALCHEMY_MAX_OVERFLOW'),
+                             ('pool_timeout', 'SQLALCHEMY_POOL_TIMEOUT')):
+            if environ.get(name):
+                options[option] = int(environ[name])
+    return options
 
 app_config = {
     'development': DevelopmentConfig,
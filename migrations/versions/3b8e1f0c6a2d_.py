@@ -0,0 +1,28 @@
+"""add rates table
+
+Revision ID: 3b8e1f0c6a2d
+Revises: 09931f79231a
+Create Date: 2020-02-18 10:02:41.512830
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e1f0c6a2d'
+down_revision = '09931f79231a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rates',
+    sa.Column('currency', sa.String(length=8), nullable=False),
+    sa.Column('rate', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('currency')
+    )
+
+
+def downgrade():
+    op.drop_table('rates')
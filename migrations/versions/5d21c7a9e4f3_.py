@@ -0,0 +1,67 @@
+"""add ledger and ledger snapshots
+
+Revision ID: 5d21c7a9e4f3
+Revises: 3b8e1f0c6a2d
+Create Date: 2020-02-20 14:37:09.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d21c7a9e4f3'
+down_revision = '3b8e1f0c6a2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ledger',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('participant_id', sa.Integer(), nullable=True),
+    sa.Column('storage_id', sa.Integer(), nullable=True),
+    sa.Column('asset', sa.String(length=8), nullable=False),
+    sa.Column('delta', sa.Float(), nullable=False),
+    sa.Column('reason', sa.String(length=32), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_ledger_participant_created', 'ledger', ['participant_id', 'created_at'], unique=False)
+    op.create_index('ix_ledger_storage_created', 'ledger', ['storage_id', 'created_at'], unique=False)
+    op.create_table('ledger_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('participant_id', sa.Integer(), nullable=True),
+    sa.Column('storage_id', sa.Integer(), nullable=True),
+    sa.Column('ledger_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('fcd', sa.Float(), nullable=True),
+    sa.Column('usd', sa.Float(), nullable=True),
+    sa.Column('sar', sa.Float(), nullable=True),
+    sa.Column('rub', sa.Float(), nullable=True),
+    sa.Column('yen', sa.Float(), nullable=True),
+    sa.Column('barrels', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_ledger_snapshots_participant_id'), 'ledger_snapshots', ['participant_id'], unique=False)
+    op.create_index(op.f('ix_ledger_snapshots_storage_id'), 'ledger_snapshots', ['storage_id'], unique=False)
+
+    # open the ledger with the balances held today
+    for currency in ('fcd', 'usd', 'sar', 'rub', 'yen'):
+        op.execute(
+            "INSERT INTO ledger (participant_id, asset, delta, reason, created_at) "
+            "SELECT id, '{0}', {0}, 'open', CURRENT_TIMESTAMP FROM participants "
+            "WHERE {0} IS NOT NULL AND {0} <> 0".format(currency))
+    op.execute(
+        "INSERT INTO ledger (storage_id, asset, delta, reason, created_at) "
+        "SELECT id, 'barrels', current_capacity, 'open', CURRENT_TIMESTAMP FROM storages "
+        "WHERE current_capacity IS NOT NULL AND current_capacity <> 0")
+
+
+def downgrade():
+    op.drop_index(op.f('ix_ledger_snapshots_storage_id'), table_name='ledger_snapshots')
+    op.drop_index(op.f('ix_ledger_snapshots_participant_id'), table_name='ledger_snapshots')
+    op.drop_table('ledger_snapshots')
+    op.drop_index('ix_ledger_storage_created', table_name='ledger')
+    op.drop_index('ix_ledger_participant_created', table_name='ledger')
+    op.drop_table('ledger')
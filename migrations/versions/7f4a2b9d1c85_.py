@@ -0,0 +1,31 @@
+"""link existing users to their participant and storage
+
+Revision ID: 7f4a2b9d1c85
+Revises: 5d21c7a9e4f3
+Create Date: 2020-02-21 09:12:55.640117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f4a2b9d1c85'
+down_revision = '5d21c7a9e4f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "UPDATE users SET userid = "
+        "(SELECT participants.id FROM participants WHERE participants.partname = users.username) "
+        "WHERE userid IS NULL")
+    op.execute(
+        "UPDATE users SET storid = "
+        "(SELECT storages.id FROM storages WHERE storages.storown = users.username) "
+        "WHERE storid IS NULL")
+
+
+def downgrade():
+    pass
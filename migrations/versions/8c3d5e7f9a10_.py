@@ -0,0 +1,26 @@
+"""add row versions to participants and storages
+
+Revision ID: 8c3d5e7f9a10
+Revises: 7f4a2b9d1c85
+Create Date: 2020-02-22 16:48:03.227519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3d5e7f9a10'
+down_revision = '7f4a2b9d1c85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('participants', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('storages', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('storages', 'version')
+    op.drop_column('participants', 'version')
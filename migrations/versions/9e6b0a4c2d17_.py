@@ -0,0 +1,33 @@
+"""index sortable participant and storage columns
+
+Revision ID: 9e6b0a4c2d17
+Revises: 8c3d5e7f9a10
+Create Date: 2020-02-24 11:05:30.904416
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e6b0a4c2d17'
+down_revision = '8c3d5e7f9a10'
+branch_labels = None
+depends_on = None
+
+PARTICIPANT_COLUMNS = ('fcd', 'usd', 'sar', 'rub', 'yen')
+STORAGE_COLUMNS = ('stornum', 'current_capacity')
+
+
+def upgrade():
+    for column in PARTICIPANT_COLUMNS:
+        op.create_index(op.f('ix_participants_' + column), 'participants', [column], unique=False)
+    for column in STORAGE_COLUMNS:
+        op.create_index(op.f('ix_storages_' + column), 'storages', [column], unique=False)
+
+
+def downgrade():
+    for column in STORAGE_COLUMNS:
+        op.drop_index(op.f('ix_storages_' + column), table_name='storages')
+    for column in PARTICIPANT_COLUMNS:
+        op.drop_index(op.f('ix_participants_' + column), table_name='participants')
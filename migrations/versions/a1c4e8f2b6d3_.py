@@ -0,0 +1,32 @@
+"""add rounds table and scheduled exchange rates
+
+Revision ID: a1c4e8f2b6d3
+Revises: 9e6b0a4c2d17
+Create Date: 2020-02-25 09:12:44.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c4e8f2b6d3'
+down_revision = '9e6b0a4c2d17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rounds',
+    sa.Column('number', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('ends_at', sa.DateTime(), nullable=False),
+    sa.Column('settled_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('number')
+    )
+    op.add_column('rates', sa.Column('next_rate', sa.Float(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('rates', 'next_rate')
+    op.drop_table('rounds')
@@ -0,0 +1,39 @@
+"""index only the sorted balance columns, together with id
+
+Revision ID: a4c6e8f0b2d5
+Revises: f1b3d5e7a9c2
+Create Date: 2020-02-28 09:42:17.305512
+
+Every index on a balance column is written again by each trade,
+adjustment and settlement. The admin lists sort by name, fcd and fill,
+so only those keep an index, ending in id for the keyset pages.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c6e8f0b2d5'
+down_revision = 'f1b3d5e7a9c2'
+branch_labels = None
+depends_on = None
+
+CURRENCIES = ('fcd', 'usd', 'sar', 'rub', 'yen')
+
+
+def upgrade():
+    for currency in CURRENCIES:
+        op.drop_index(op.f('ix_participants_' + currency), table_name='participants')
+    for column in ('stornum', 'current_capacity'):
+        op.drop_index(op.f('ix_storages_' + column), table_name='storages')
+    op.create_index('ix_participants_fcd_id', 'participants', ['fcd', 'id'], unique=False)
+    op.create_index('ix_storages_current_capacity_id', 'storages', ['current_capacity', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_storages_current_capacity_id', table_name='storages')
+    op.drop_index('ix_participants_fcd_id', table_name='participants')
+    for column in ('stornum', 'current_capacity'):
+        op.create_index(op.f('ix_storages_' + column), 'storages', [column], unique=False)
+    for currency in CURRENCIES:
+        op.create_index(op.f('ix_participants_' + currency), 'participants', [currency], unique=False)
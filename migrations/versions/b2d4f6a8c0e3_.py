@@ -0,0 +1,73 @@
+"""store ledger deltas and snapshots as integer minor units
+
+Revision ID: b2d4f6a8c0e3
+Revises: a4c6e8f0b2d5
+Create Date: 2020-02-29 11:06:31.482913
+
+Ledger deltas of every asset share one column, kept in millionths, and
+snapshots keep each currency at the scale of its balance column. The
+ledger is only ever appended to, so it is filled in chunks of ids, each
+committed on its own, and entries added meanwhile are copied right before
+the swap. Writes must be paused for the swaps, as for c3f9a1d7e5b2: code of
+either version would otherwise store deltas at the wrong scale.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2d4f6a8c0e3'
+down_revision = 'a4c6e8f0b2d5'
+branch_labels = None
+depends_on = None
+
+CURRENCIES = ('fcd', 'usd', 'sar', 'rub', 'yen')
+# minor units per unit, as in models.CURRENCY_PLACES
+SCALES = {'fcd': 10 ** 2, 'usd': 10 ** 6, 'sar': 10 ** 6, 'rub': 10 ** 6, 'yen': 10 ** 6}
+DELTA_SCALE = 10 ** 6
+CHUNK = 1000
+
+
+def _swap(table, column, type_, nullable):
+    op.drop_column(table, column)
+    if op.get_bind().dialect.name == 'sqlite':
+        # cannot change a column's NULL constraint, it stays nullable
+        nullable = None
+    op.alter_column(table, column + '_new', new_column_name=column,
+                    existing_type=type_, existing_nullable=True, nullable=nullable)
+
+
+def upgrade():
+    bind = op.get_bind()
+    # a column left behind by an upgrade that stopped halfway
+    existing = set(c['name'] for c in sa.inspect(bind).get_columns('ledger'))
+    copy = "UPDATE ledger SET delta_new = ROUND(delta * {}) WHERE ".format(DELTA_SCALE)
+
+    with op.get_context().autocommit_block():
+        if 'delta_new' not in existing:
+            op.add_column('ledger', sa.Column('delta_new', sa.BigInteger(), nullable=True))
+        last = bind.execute(sa.text("SELECT MAX(id) FROM ledger")).scalar() or 0
+        for start in range(0, last, CHUNK):
+            bind.execute(sa.text(copy + "id > :start AND id <= :end"),
+                         start=start, end=start + CHUNK)
+
+    bind.execute(sa.text(copy + "delta_new IS NULL"))
+    _swap('ledger', 'delta', sa.BigInteger(), False)
+
+    for currency in CURRENCIES:
+        op.add_column('ledger_snapshots', sa.Column(currency + '_new', sa.BigInteger(), nullable=True))
+        op.execute("UPDATE ledger_snapshots SET {0}_new = ROUND(COALESCE({0}, 0) * {1})".format(
+            currency, SCALES[currency]))
+        _swap('ledger_snapshots', currency, sa.BigInteger(), True)
+
+
+def downgrade():
+    for currency in CURRENCIES:
+        op.add_column('ledger_snapshots', sa.Column(currency + '_new', sa.Float(), nullable=True))
+        op.execute("UPDATE ledger_snapshots SET {0}_new = {0} / {1}.0".format(
+            currency, SCALES[currency]))
+        _swap('ledger_snapshots', currency, sa.Float(), True)
+
+    op.add_column('ledger', sa.Column('delta_new', sa.Float(), nullable=True))
+    op.execute("UPDATE ledger SET delta_new = delta / {}.0".format(DELTA_SCALE))
+    _swap('ledger', 'delta', sa.Float(), False)
@@ -0,0 +1,32 @@
+"""add rate_history table
+
+Revision ID: b7d2f5a8c3e1
+Revises: a1c4e8f2b6d3
+Create Date: 2020-02-25 14:40:18.203977
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2f5a8c3e1'
+down_revision = 'a1c4e8f2b6d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_history',
+    sa.Column('round', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('usd', sa.Float(), nullable=True),
+    sa.Column('sar', sa.Float(), nullable=True),
+    sa.Column('rub', sa.Float(), nullable=True),
+    sa.Column('yen', sa.Float(), nullable=True),
+    sa.Column('barrels', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('round')
+    )
+
+
+def downgrade():
+    op.drop_table('rate_history')
@@ -0,0 +1,97 @@
+"""store participant balances as integer minor units
+
+Revision ID: c3f9a1d7e5b2
+Revises: b7d2f5a8c3e1
+Create Date: 2020-02-26 10:12:44.530918
+
+MFD is kept in hundredths and the other currencies, each worth thousands
+of MFD a unit, in millionths, so no balance loses a digit that is still
+money. The new BIGINT columns are filled next to the old ones in chunks of
+ids, each committed on its own, so no transaction holds more than CHUNK
+row locks while the game keeps running. Rows written during the backfill
+have moved on to a newer version and are copied again right before each
+column is swapped; if rows are still changing after CATCH_UP_PASSES the
+migration stops, and can be run again once writes are quieter.
+
+Writes must be paused for the swaps at the end: code of either version
+writing while some columns hold major units and others minor units would
+store balances off by a factor of the scale.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f9a1d7e5b2'
+down_revision = 'b7d2f5a8c3e1'
+branch_labels = None
+depends_on = None
+
+CURRENCIES = ('fcd', 'usd', 'sar', 'rub', 'yen')
+# minor units per unit, as in models.CURRENCY_PLACES
+SCALES = {'fcd': 10 ** 2, 'usd': 10 ** 6, 'sar': 10 ** 6, 'rub': 10 ** 6, 'yen': 10 ** 6}
+CHUNK = 1000
+CATCH_UP_PASSES = 5
+
+
+def _copy(assignments, where):
+    return "UPDATE participants SET {}, money_version = version WHERE {}".format(
+        ', '.join(assignments), where)
+
+
+def _assignments(currencies):
+    return ['{0}_minor = ROUND(COALESCE({0}, 0) * {1})'.format(c, SCALES[c])
+            for c in currencies]
+
+
+def _catch_up(bind, currencies):
+    """
+    Copy rows written since they were last copied, until none are left
+    """
+    for _ in range(CATCH_UP_PASSES):
+        changed = bind.execute(sa.text(_copy(
+            _assignments(currencies), "money_version IS NULL OR money_version <> version")))
+        if not changed.rowcount:
+            return
+    raise RuntimeError('participants kept changing during the backfill, '
+                       'run the upgrade again when writes are quieter')
+
+
+def upgrade():
+    bind = op.get_bind()
+    # columns left behind by an upgrade that stopped in _catch_up
+    existing = set(c['name'] for c in sa.inspect(bind).get_columns('participants'))
+
+    with op.get_context().autocommit_block():
+        for currency in CURRENCIES:
+            if currency + '_minor' not in existing:
+                op.add_column('participants', sa.Column(currency + '_minor', sa.BigInteger(), nullable=True))
+        if 'money_version' not in existing:
+            op.add_column('participants', sa.Column('money_version', sa.Integer(), nullable=True))
+
+        last = bind.execute(sa.text("SELECT MAX(id) FROM participants")).scalar() or 0
+        for start in range(0, last, CHUNK):
+            bind.execute(sa.text(_copy(_assignments(CURRENCIES), "id > :start AND id <= :end")),
+                         start=start, end=start + CHUNK)
+        _catch_up(bind, CURRENCIES)
+
+    for i, currency in enumerate(CURRENCIES):
+        _catch_up(bind, CURRENCIES[i:])
+        op.drop_index(op.f('ix_participants_' + currency), table_name='participants')
+        op.drop_column('participants', currency)
+        op.alter_column('participants', currency + '_minor', new_column_name=currency,
+                        existing_type=sa.BigInteger(), existing_nullable=True)
+        op.create_index(op.f('ix_participants_' + currency), 'participants', [currency], unique=False)
+    op.drop_column('participants', 'money_version')
+
+
+def downgrade():
+    for currency in CURRENCIES:
+        op.add_column('participants', sa.Column(currency + '_major', sa.Float(), nullable=True))
+        op.execute("UPDATE participants SET {0}_major = {0} / {1}.0".format(
+            currency, SCALES[currency]))
+        op.drop_index(op.f('ix_participants_' + currency), table_name='participants')
+        op.drop_column('participants', currency)
+        op.alter_column('participants', currency + '_major', new_column_name=currency,
+                        existing_type=sa.Float(), existing_nullable=True)
+        op.create_index(op.f('ix_participants_' + currency), 'participants', [currency], unique=False)
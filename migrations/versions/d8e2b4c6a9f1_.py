@@ -0,0 +1,39 @@
+"""add audit_log table
+
+Revision ID: d8e2b4c6a9f1
+Revises: c3f9a1d7e5b2
+Create Date: 2020-02-26 16:05:31.774102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8e2b4c6a9f1'
+down_revision = 'c3f9a1d7e5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('audit_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('actor_id', sa.Integer(), nullable=True),
+    sa.Column('actor', sa.String(length=60), nullable=True),
+    sa.Column('action', sa.String(length=32), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('target_id', sa.Integer(), nullable=True),
+    sa.Column('partname', sa.String(length=60), nullable=True),
+    sa.Column('details', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_audit_log_created_at'), 'audit_log', ['created_at'], unique=False)
+    op.create_index('ix_audit_log_partname_created', 'audit_log', ['partname', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_audit_log_partname_created', table_name='audit_log')
+    op.drop_index(op.f('ix_audit_log_created_at'), table_name='audit_log')
+    op.drop_table('audit_log')
@@ -0,0 +1,34 @@
+"""add users.disabled and revocations table
+
+Revision ID: e5a7c9d1f3b8
+Revises: d8e2b4c6a9f1
+Create Date: 2020-02-27 09:48:12.306554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a7c9d1f3b8'
+down_revision = 'd8e2b4c6a9f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('disabled', sa.Boolean(), nullable=False, server_default='0'))
+    op.create_table('revocations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=40), nullable=False),
+    sa.Column('revoked_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_revocations_expires_at'), 'revocations', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_revocations_expires_at'), table_name='revocations')
+    op.drop_table('revocations')
+    op.drop_column('users', 'disabled')
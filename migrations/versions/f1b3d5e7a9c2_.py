@@ -0,0 +1,24 @@
+"""index ledger by created_at
+
+Revision ID: f1b3d5e7a9c2
+Revises: e5a7c9d1f3b8
+Create Date: 2020-02-27 15:21:40.118375
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b3d5e7a9c2'
+down_revision = 'e5a7c9d1f3b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_ledger_created', 'ledger', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_ledger_created', table_name='ledger')